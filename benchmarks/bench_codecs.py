@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+快照编码基准测试 - 对比各编码的文件大小、编码（dump）与解析（parse）耗时
+用法: python benchmarks/bench_codecs.py [记录数 ...]
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_store import make_dataset
+from storage import BinaryCodec, JsonCodec, decode_data, orjson
+
+
+def codecs():
+    result = [('json（缩进，原格式）', JsonCodec()), ('compact', JsonCodec(indent=None))]
+    if orjson is not None:
+        from storage import OrjsonCodec
+        result.append(('orjson', OrjsonCodec()))
+    result.append(('binary', BinaryCodec()))
+    return result
+
+
+def timed(fn):
+    gc.collect()
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+
+def run(n):
+    data = make_dataset(n)
+    print(f"记录数 {n}")
+    print(f"  {'编码':<20} {'大小 MB':>10} {'dump ms':>10} {'parse ms':>10}")
+    baseline = None
+    for label, codec in codecs():
+        raw, dump_time = timed(lambda: codec.dumps(data))
+        if baseline is None:
+            # 基准：原实现 json.dump(indent=2) + json.load
+            _, parse_time = timed(lambda: json.loads(raw.decode('utf-8')))
+            baseline = (dump_time, parse_time)
+            print(f"  {'标准库 json.load':<20} {'':>10} {'':>10} {parse_time * 1e3:>10.1f}")
+        parsed, parse_time = timed(lambda: decode_data(raw))
+        assert parsed == data, label
+        print(f"  {label:<20} {len(raw) / 1e6:>10.1f} {dump_time * 1e3:>10.1f} {parse_time * 1e3:>10.1f}"
+              f"   dump {baseline[0] / dump_time:.1f}x parse {baseline[1] / parse_time:.1f}x")
+        del raw, parsed
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for size in sizes:
+        run(size)
+        print()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+密码校验基准测试 - 多个请求线程同时登录时，不同进程池大小下每秒可完成的登录数，
+以及同时进行的轻量请求（如读取数据）的延迟；批量注册时 hash_many 的耗时和并行度
+用法: python benchmarks/bench_passwords.py [迭代次数] [进程池大小 ...]
+"""
+
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from passwords import HasherBusy, PasswordHasher, hash_password
+
+THREADS = 16
+LOGINS = 64
+
+
+def light_request_latency(stop):
+    """模拟其他请求：每10毫秒做一次轻量计算，记录实际耗时"""
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        sum(range(1000))
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    return samples
+
+
+def run(iterations, workers):
+    hasher = PasswordHasher(workers, max_queue=LOGINS, iterations=iterations)
+    stored = hash_password('secret', iterations)
+    hasher.verify('secret', stored)  # 预热进程池
+
+    stop = threading.Event()
+    with ThreadPoolExecutor(THREADS + 1) as pool:
+        probe = pool.submit(light_request_latency, stop)
+        start = time.perf_counter()
+        results = list(pool.map(lambda _: hasher.verify('secret', stored)[0], range(LOGINS)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        samples = probe.result()
+    hasher.close()
+    assert all(results)
+
+    label = '当前线程' if workers == 0 else f'{workers} 进程'
+    p99 = sorted(samples)[int(len(samples) * 0.99) - 1] if samples else 0
+    print(f"  {label:<10} {LOGINS / elapsed:>10.1f} {statistics.median(samples) * 1e3:>12.2f} {p99 * 1e3:>12.2f}")
+
+
+def run_bulk(iterations, workers, count=256):
+    """hash_many 应让所有进程同时工作：记录同时在执行的块数的峰值"""
+    hasher = PasswordHasher(workers, max_queue=LOGINS, iterations=iterations)
+    hasher.hash('secret')  # 预热进程池
+    lock = threading.Lock()
+    running = peak = 0
+    submit = hasher._pool.submit
+
+    def done(_):
+        nonlocal running
+        with lock:
+            running -= 1
+
+    def counting_submit(*args):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        future = submit(*args)
+        future.add_done_callback(done)
+        return future
+
+    hasher._pool.submit = counting_submit
+    start = time.perf_counter()
+    hashes = hasher.hash_many([str(i) for i in range(count)])
+    elapsed = time.perf_counter() - start
+    hasher.close()
+    ok = len(hashes) == count and peak == workers
+    print(f"  {workers} 进程批量哈希 {count} 个：{elapsed:.2f}s，{count / elapsed:.1f} 个/秒，"
+          f"同时执行 {peak} 块 {'通过' if ok else '失败'}")
+    return ok
+
+
+def run_overload(iterations):
+    """队列已满时新的登录立即被拒绝，而不是排队等待"""
+    hasher = PasswordHasher(1, max_queue=2, iterations=iterations)
+    stored = hash_password('secret', iterations)
+    rejected = 0
+
+    def attempt(_):
+        nonlocal rejected
+        try:
+            hasher.verify('secret', stored)
+        except HasherBusy:
+            rejected += 1
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(attempt, range(THREADS)))
+    hasher.close()
+    print(f"  1 进程、排队上限 2、{THREADS} 个并发登录：拒绝 {rejected} 个")
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    sizes = [int(arg) for arg in sys.argv[2:]] or [0, 1, 2, 4, os.cpu_count() or 1]
+    print(f"PBKDF2-SHA256 {iterations} 次迭代，{THREADS} 个请求线程，共 {LOGINS} 次登录")
+    print(f"  {'哈希位置':<10} {'登录/秒':>10} {'轻量请求 ms':>12} {'p99 ms':>12}")
+    for workers in sorted(set(sizes)):
+        run(iterations, workers)
+    run_overload(iterations)
+    results = [run_bulk(iterations, workers) for workers in sorted(set(sizes)) if workers]
+    if not all(results):
+        sys.exit(1)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储层基准测试 - 对比逐请求读写文件与常驻内存存储
+用法: python benchmarks/bench_store.py [记录数 ...]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storage import JsonStore, load_json_data, save_json_data
+
+
+def make_dataset(n):
+    """生成与 data.json 结构相同的测试数据"""
+    now = datetime.now().isoformat()
+    return {
+        "donations": [
+            {"id": str(i), "user_id": str(i % 500), "amount": 50.0, "payment_method": "wallet",
+             "status": "completed", "message": "", "created_at": now}
+            for i in range(n)
+        ],
+        "members": [
+            {"id": str(i), "username": f"member{i}", "email": f"m{i}@example.com", "joined_at": now}
+            for i in range(n // 10)
+        ],
+        "applications": [],
+        "events": [],
+        "wallets": {str(i): {"balance": 100.0, "updated_at": now} for i in range(500)},
+        "wallet_transactions": [
+            {"id": str(i), "user_id": str(i % 500), "type": "deposit", "amount": 10.0,
+             "description": "", "status": "completed", "created_at": now}
+            for i in range(n)
+        ],
+        "userPresence": {},
+    }
+
+
+def legacy_heartbeat(filename, i):
+    """原实现：每次心跳完整解析并重写数据文件"""
+    data = load_json_data(filename)
+    data.setdefault('userPresence', {})[f"user{i % 100}"] = {
+        'online': True, 'lastActive': datetime.now().isoformat()
+    }
+    save_json_data(filename, data)
+
+
+def legacy_read(filename):
+    data = load_json_data(filename)
+    return data.get('donations', [])
+
+
+def store_heartbeat(store, i):
+    store.put('userPresence', f"user{i % 100}", {
+        'online': True, 'lastActive': datetime.now().isoformat()
+    })
+
+
+def store_read(store):
+    return store.all('donations', [])
+
+
+def measure(label, fn, ops):
+    start = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<24} {elapsed / ops * 1e6:>12.1f} us/op {ops / elapsed:>12.0f} ops/s")
+    return elapsed
+
+
+def run(n):
+    workdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(workdir, 'data.json')
+        save_json_data(filename, make_dataset(n))
+        size_kb = os.path.getsize(filename) / 1024
+        print(f"记录数 {n}（data.json {size_kb:.0f} KB）")
+
+        ops = max(5, min(200, 200_000 // max(n, 1)))
+        legacy_w = measure("原实现 心跳写入", lambda i: legacy_heartbeat(filename, i), ops)
+        legacy_r = measure("原实现 读取捐款", lambda i: legacy_read(filename), ops)
+
+        # 关闭自动写回，单独测量一次完整写回的耗时
+        store = JsonStore(filename, flush_interval=3600, flush_threshold=10 ** 9).start()
+        store_ops = 20000
+        store_w = measure("常驻存储 心跳写入", lambda i: store_heartbeat(store, i), store_ops)
+        store_r = measure("常驻存储 读取捐款", lambda i: store_read(store), store_ops)
+        flush_start = time.perf_counter()
+        store.flush()
+        print(f"  {'常驻存储 单次写回':<24} {(time.perf_counter() - flush_start) * 1e3:>12.1f} ms")
+
+        print(f"  写入加速 {legacy_w / ops / (store_w / store_ops):.0f}x，"
+              f"读取加速 {legacy_r / ops / (store_r / store_ops):.0f}x")
+        store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    for size in sizes:
+        run(size)
+        print()
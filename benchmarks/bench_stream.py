@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应编码基准测试 - 对比整体编码（jsonify）与逐段流式编码的首字节时间和峰值内存，
+以及 gzip / brotli 压缩后的大小
+用法: python benchmarks/bench_stream.py [记录数 ...]
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_store import make_dataset
+from compression import ENCODINGS, compress_stream
+from storage import iter_json
+
+
+def measure(chunks_fn):
+    """返回 (首块耗时, 总耗时, 峰值内存, 总字节数)；内存单独测一遍，避免 tracemalloc 影响计时"""
+    gc.collect()
+    start = time.perf_counter()
+    first = None
+    total = 0
+    for chunk in chunks_fn():
+        if first is None:
+            first = time.perf_counter() - start
+        total += len(chunk)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    for _ in chunks_fn():
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, elapsed, peak, total
+
+
+def run(n):
+    data = make_dataset(n)
+    print(f"记录数 {n}")
+    print(f"  {'方式':<22} {'首字节 ms':>10} {'总耗时 ms':>10} {'峰值 MB':>10} {'大小 MB':>10}")
+    cases = [
+        # 原实现：jsonify 先拼出整个字符串再发送
+        ('整体编码', lambda: [json.dumps(data).encode('utf-8')]),
+        ('流式编码', lambda: (chunk.encode('utf-8') for chunk in iter_json(data))),
+    ]
+    for encoding in ENCODINGS:
+        cases.append((f'流式编码 + {encoding}', lambda encoding=encoding: compress_stream(iter_json(data), encoding)))
+    for label, chunks_fn in cases:
+        first, elapsed, peak, total = measure(chunks_fn)
+        print(f"  {label:<22} {first * 1e3:>10.1f} {elapsed * 1e3:>10.1f} {peak / 1e6:>10.1f} {total / 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    for size in sizes:
+        run(size)
+        print()
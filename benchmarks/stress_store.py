@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储层并发压力测试 - 多线程、多进程同时写入捐款和钱包交易，验证没有丢失任何修改
+用法: python benchmarks/stress_store.py [线程数] [每线程操作数]
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from storage import GroupCommitWriter, JsonStore, SqliteStore, SQLITE_TABLES, group_writer, save_json_data
+
+WALLET_USERS = 8
+
+
+def deposit(store, user_id, amount):
+    """与 server.create_wallet_transaction 相同的读-改-写流程"""
+    with store.transaction('wallets', 'wallet_transactions'):
+        wallet = dict(store.get('wallets', user_id) or {'balance': 0.00})
+        wallet['balance'] += float(amount)
+        wallet['updated_at'] = datetime.now().isoformat()
+        store.insert('wallet_transactions', {
+            'id': f"{user_id}-{time.perf_counter_ns()}",
+            'user_id': user_id,
+            'type': 'deposit',
+            'amount': float(amount),
+            'created_at': datetime.now().isoformat()
+        })
+        store.put('wallets', user_id, wallet)
+
+
+def writer(store, worker, ops):
+    for i in range(ops):
+        store.insert('donations', {
+            'id': f"{worker}-{i}",
+            'user_id': str(worker),
+            'amount': 1,
+            'created_at': datetime.now().isoformat()
+        })
+        deposit(store, str(i % WALLET_USERS), 1)
+
+
+def reader(store, stop):
+    while not stop.is_set():
+        store.all('donations', [])
+        store.find('wallet_transactions', 'user_id', '0')
+        store.snapshot()
+
+
+def check(store, expected, label):
+    donations = store.all('donations', [])
+    transactions = store.all('wallet_transactions', [])
+    balance = sum(w['balance'] for w in (store.all('wallets', {}) or {}).values())
+    ids = {d['id'] for d in donations}
+    ok = len(donations) == expected and len(ids) == expected and \
+        len(transactions) == expected and balance == expected
+    print(f"  {label:<10} 捐款 {len(donations)}/{expected} 交易 {len(transactions)}/{expected} "
+          f"余额合计 {balance:.0f}/{expected} {'通过' if ok else '失败'}")
+    return ok
+
+
+def open_shared_store(workdir):
+    # 压缩阈值设得很小，让各进程的压缩与写入交错进行
+    return JsonStore(os.path.join(workdir, 'data.json'), {}, 0.01, 50, journal_fsync=False,
+                     shard_dir=os.path.join(workdir, 'data.d'), shared=True).start()
+
+
+def process_writer(workdir, worker, ops):
+    store = open_shared_store(workdir)
+    writer(store, worker, ops)
+    store.close()
+
+
+def run_processes(workdir, processes, ops):
+    print(f"JsonStore(shared): {processes} 个写进程 × {ops} 次操作")
+    open_shared_store(workdir).close()
+    workers = [multiprocessing.Process(target=process_writer, args=(workdir, w, ops)) for w in range(processes)]
+
+    start = time.perf_counter()
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    elapsed = time.perf_counter() - start
+    print(f"  耗时 {elapsed:.2f}s，{processes * ops * 2 / elapsed:.0f} 次写入/s")
+
+    store = open_shared_store(workdir)
+    ok = check(store, processes * ops, '合并后')
+    store.close()
+    return ok
+
+
+def run_group_commit(workdir, threads, ops):
+    """多线程并发保存同一批文件，读取方不能看到写了一半的文件"""
+    print(f"save_json_data: {threads} 个写线程 × {ops} 次保存")
+    files = [os.path.join(workdir, f"file{i}.json") for i in range(4)]
+    commits = [0]
+    original = GroupCommitWriter._commit
+
+    def counting_commit(batch_files):
+        commits[0] += 1
+        return original(batch_files)
+
+    group_writer._commit = counting_commit
+    stop = threading.Event()
+    torn = []
+
+    def save(worker):
+        for i in range(ops):
+            if not save_json_data(files[(worker + i) % len(files)], {'worker': worker, 'i': i, 'pad': 'x' * 4096}):
+                torn.append('保存失败')
+
+    def check_files():
+        while not stop.is_set():
+            for name in files:
+                if os.path.exists(name):
+                    try:
+                        with open(name, encoding='utf-8') as f:
+                            json.load(f)
+                    except ValueError:
+                        torn.append(name)
+
+    checker = threading.Thread(target=check_files)
+    writers = [threading.Thread(target=save, args=(w,)) for w in range(threads)]
+    start = time.perf_counter()
+    checker.start()
+    for t in writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    checker.join()
+    elapsed = time.perf_counter() - start
+    del group_writer._commit
+    leftovers = [name for name in os.listdir(workdir) if name.endswith('.tmp')]
+
+    ok = not torn and not leftovers
+    print(f"  耗时 {elapsed:.2f}s，{threads * ops} 次保存合并为 {commits[0]} 次提交，"
+          f"损坏读取 {len(torn)}，残留临时文件 {len(leftovers)} {'通过' if ok else '失败'}")
+    return ok
+
+
+def run(name, open_store, threads, ops):
+    print(f"{name}: {threads} 个写线程 × {ops} 次操作")
+    store = open_store()
+    stop = threading.Event()
+    readers = [threading.Thread(target=reader, args=(store, stop)) for _ in range(2)]
+    writers = [threading.Thread(target=writer, args=(store, w, ops)) for w in range(threads)]
+
+    start = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"  耗时 {elapsed:.2f}s，{threads * ops * 2 / elapsed:.0f} 次写入/s")
+
+    expected = threads * ops
+    ok = check(store, expected, '写入后')
+    store.close()
+
+    reopened = open_store()
+    ok = check(reopened, expected, '重新加载') and ok
+    reopened.close()
+    return ok
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    ops = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, 'shared'))
+    os.makedirs(os.path.join(workdir, 'commit'))
+    try:
+        data_file = os.path.join(workdir, 'data.json')
+        data_collections = [name for name in SQLITE_TABLES if name != 'users']
+        results = [
+            # 压缩阈值设得很小，让后台压缩与写入交错进行
+            run('JsonStore', lambda: JsonStore(data_file, {}, 0.01, 50, journal_fsync=False,
+                                               shard_dir=os.path.join(workdir, 'data.d')).start(),
+                threads, ops),
+            run('SqliteStore', lambda: SqliteStore(os.path.join(workdir, 'data.db'), data_collections,
+                                                   extras=True, journal_fsync=False),
+                threads, ops),
+            run_processes(os.path.join(workdir, 'shared'), max(4, min(threads, os.cpu_count() or 1)), ops),
+            run_group_commit(os.path.join(workdir, 'commit'), threads, ops),
+        ]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if all(results) else 1)
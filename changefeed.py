@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据变更源 - 存储层的每次修改分配一个递增版本号，供 SSE 推送和增量同步使用
+"""
+
+import itertools
+import threading
+import uuid
+from collections import deque
+
+
+class ChangeFeed:
+    """数据变更源
+
+    作为存储的监听函数接收修改通知，保留最近 history 条变更供订阅者等待和补发。
+    版本令牌形如 <纪元>-<序号>-<实例>-<版本号>：版本号是本实例中变更的顺序，
+    序号是存储的修改序号。纪元在每个进程启动时重新生成，客户端带着其他进程
+    或重启前的令牌来时视为历史已丢失，需要整体重新同步。
+    exclude 中的集合（如管理员会话）不对外发布，但仍参与ETag计算。
+
+    给出 source（共享模式的存储，提供 epoch、各进程一致的修改序号 seq 和 stamp()）时，
+    纪元和序号来自存储：其他进程签发的令牌按序号定位到本实例的历史中，
+    ETag 也由存储的修改戳生成，在各工作进程间通用。local 中的集合（如在线状态）
+    不来自 source，不占用序号；按序号定位时与令牌序号相同的这类变更会再发一次。
+    """
+
+    def __init__(self, history=1000, exclude=(), source=None, local=()):
+        self.source = source
+        self.epoch = getattr(source, 'epoch', None) or uuid.uuid4().hex[:8]
+        self.instance = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.exclude = set(exclude)
+        self.local = set(local)
+        self._events = deque(maxlen=history)
+        self._cond = threading.Condition()
+        # 修改戳：每次修改（含不发布的集合）递增，记录各集合最后一次修改
+        self._stamp = 0
+        self._stamps = {}
+        self._reset_stamp = 0
+        # 最近一次变更时的修改序号；序号不小于 _floor 的令牌在历史中都能定位
+        self._seq = source.seq if source is not None else 0
+        self._floor = self._seq
+
+    def publish(self, collection, kind, key=None, value=None):
+        """记录一次变更，签名与存储的监听函数一致"""
+        with self._cond:
+            self._stamp += 1
+            if collection is None:
+                self._reset_stamp = self._stamp
+            else:
+                self._stamps[collection] = self._stamp
+            local = self.source is not None and collection in self.local
+            if self.source is None:
+                self._seq = self._stamp
+            elif not local:
+                self._seq = self.source.seq
+            if collection in self.exclude:
+                return
+            self.version += 1
+            if self._events and len(self._events) == self._events.maxlen:
+                dropped = self._events[0]
+                self._floor = dropped['seq'] + dropped['local']
+            self._events.append({'v': self.version, 'seq': self._seq, 'local': local,
+                                 'collection': collection, 'op': kind, 'key': key, 'value': value})
+            self._cond.notify_all()
+
+    def token(self, version=None):
+        """当前（或给定）版本的令牌"""
+        with self._cond:
+            if version is None:
+                version, seq = self.version, self._seq
+            elif self._events and self._events[0]['v'] <= version <= self.version:
+                seq = self._events[version - self._events[0]['v']]['seq']
+            else:
+                # 变更已不在历史中，序号取最小值，其他进程据此要求整体同步
+                seq = 0
+        return f"{self.epoch}-{seq}-{self.instance}-{version}"
+
+    def etag(self, collections=()):
+        """由给定集合最后一次修改生成的强ETag，不指定集合时对应整个文档"""
+        if self.source is not None:
+            return f"{self.epoch}-{self.source.stamp(collections)}"
+        with self._cond:
+            if collections:
+                stamp = max([self._reset_stamp] + [self._stamps.get(name, 0) for name in collections])
+            else:
+                stamp = self._stamp
+        return f"{self.epoch}-{stamp}"
+
+    def since(self, token):
+        """返回令牌之后的全部变更；令牌无效或历史已不完整时返回 None"""
+        with self._cond:
+            return self._since(token)
+
+    def wait(self, token, timeout):
+        """等待令牌之后的变更，超时返回空列表"""
+        with self._cond:
+            events = self._since(token)
+            if events == []:
+                self._cond.wait(timeout)
+                events = self._since(token)
+            return events
+
+    def changes(self, token):
+        """汇总令牌之后各集合的最终变化，返回 (新令牌, 增量)
+
+        增量形如 {集合: {'records': {id: 记录}, 'items': {键: 值}, 'deleted': [键]}}，
+        records 来自列表集合的 insert/update，items 和 deleted 来自字典集合。
+        集合被整体替换过，或列表集合中有记录没有 id、无法按键合并时，该集合的值为 None，
+        需整体获取。
+        无法给出增量（令牌无效、历史不完整或期间整体替换过）时增量为 None。
+        """
+        with self._cond:
+            events = self._since(token)
+            current = self.token()
+        if events is None or any(event['collection'] is None for event in events):
+            return current, None
+
+        delta = {}
+        for event in events:
+            name = event['collection']
+            if name in delta and delta[name] is None:
+                continue
+            change = delta.setdefault(name, {'records': {}, 'items': {}, 'deleted': []})
+            if event['op'] == 'set':
+                delta[name] = None
+            elif event['op'] in ('insert', 'update'):
+                if event['key'] is None:
+                    delta[name] = None
+                else:
+                    change['records'][str(event['key'])] = event['value']
+            elif event['op'] == 'put':
+                change['items'][event['key']] = event['value']
+                if event['key'] in change['deleted']:
+                    change['deleted'].remove(event['key'])
+            else:
+                change['items'].pop(event['key'], None)
+                change['deleted'].append(event['key'])
+        return (self.token(events[-1]['v']) if events else token), delta
+
+    def _since(self, token):
+        parts = str(token or '').split('-')
+        if len(parts) != 4 or parts[0] != self.epoch or not parts[1].isdigit() or not parts[3].isdigit():
+            return None
+        version = int(parts[3]) if parts[2] == self.instance else self._position(int(parts[1]))
+        if version is None or version > self.version:
+            return None
+        if version == self.version:
+            return []
+        # 版本号连续，按偏移直接定位
+        if not self._events or self._events[0]['v'] > version + 1:
+            return None
+        return list(itertools.islice(self._events, version + 1 - self._events[0]['v'], None))
+
+    def _position(self, seq):
+        """其他实例签发的令牌在本实例历史中的位置：序号不超过 seq 的最后一条存储变更之后"""
+        if seq < self._floor or seq > self._seq:
+            return None
+        for event in reversed(self._events):
+            if event['seq'] < seq or event['seq'] == seq and not event['local']:
+                return event['v']
+        return self._events[0]['v'] - 1 if self._events else self.version
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应压缩 - 按 Accept-Encoding 选择 brotli 或 gzip，支持整体压缩和流式压缩
+"""
+
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # 未安装时只提供gzip
+    brotli = None
+
+# 服务器支持的编码，按优先顺序
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# 可压缩的非 text/* 类型
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+}
+
+
+def compressible(mimetype):
+    """该类型是否值得压缩；事件流需要逐条送达，不能压缩"""
+    if mimetype == 'text/event-stream':
+        return False
+    return mimetype in COMPRESSIBLE_TYPES or (mimetype or '').startswith('text/')
+
+
+def negotiate(accept_encodings):
+    """按客户端的 Accept-Encoding（含q值）选出编码，不接受任何压缩时返回 None"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(data, encoding, level=6):
+    """整体压缩"""
+    if encoding == 'br':
+        # brotli 质量取值 0-11，动态响应用中等质量兼顾速度
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+def compress_stream(chunks, encoding, level=6):
+    """逐块压缩，块可以是字符串或字节串"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31：带gzip头
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        out = process(chunk)
+        if out:
+            yield out
+    yield finish()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+到期队列 - 按到期时间触发回调，用于在线状态和管理员会话的过期清理
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class ExpiryQueue:
+    """按键记录到期时间，到期时在后台线程中调用 callback(key)
+
+    到期时间放在最小堆中，后台线程睡到堆顶到期为止，不扫描全部键。
+    每个键在堆中通常只有一项：推迟到期时间只改记录，堆顶弹出时发现已被推迟再放回，
+    频繁续期（如心跳）不会让堆增长；每次唤醒的工作量只与到期和被推迟的键数成正比。
+    """
+
+    def __init__(self, callback, clock=time.time):
+        self.callback = callback
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._heap = []
+        self._deadlines = {}
+        # 键在堆中有效的那一项的序号，其余项弹出时丢弃
+        self._entries = {}
+        self._counter = itertools.count()
+        self._thread = None
+
+    def __contains__(self, key):
+        with self._cond:
+            return key in self._deadlines
+
+    def __len__(self):
+        with self._cond:
+            return len(self._deadlines)
+
+    def schedule(self, key, deadline):
+        """设置（或更新）键的到期时间"""
+        with self._cond:
+            self._deadlines[key] = deadline
+            current = self._entries.get(key)
+            if current is not None and current[0] <= deadline:
+                return
+            entry = (deadline, next(self._counter), key)
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def cancel(self, key):
+        """取消键的到期，返回原到期时间"""
+        with self._cond:
+            return self._deadlines.pop(key, None)
+
+    def deadline(self, key):
+        with self._cond:
+            return self._deadlines.get(key)
+
+    def expire(self, now=None):
+        """处理已到期的键，返回这些键"""
+        with self._cond:
+            keys = self._pop_expired(self.clock() if now is None else now)
+        for key in keys:
+            try:
+                self.callback(key)
+            except Exception as e:
+                print(f"处理到期 {key} 失败: {e}")
+        return keys
+
+    def _pop_expired(self, now):
+        keys = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            key = entry[2]
+            if self._entries.get(key) is not entry:
+                continue
+            del self._entries[key]
+            deadline = self._deadlines.get(key)
+            if deadline is None:
+                continue
+            if deadline > now:
+                # 已被推迟，按新的到期时间放回
+                entry = (deadline, next(self._counter), key)
+                self._entries[key] = entry
+                heapq.heappush(self._heap, entry)
+            else:
+                del self._deadlines[key]
+                keys.append(key)
+        return keys
+
+    def start(self):
+        """启动后台线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > self.clock():
+                    self._cond.wait(self._heap[0][0] - self.clock() if self._heap else None)
+            self.expire()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+幂等键 - 按 Idempotency-Key 缓存写接口的响应，客户端重试时直接返回原结果
+
+单进程时响应保存在内存中；多进程部署时保存在各进程共享的存储中（SharedIdempotencyCache）。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdempotencyConflict(ValueError):
+    """同一个幂等键用于了不同的请求内容"""
+
+
+class IdempotencyBusy(RuntimeError):
+    """使用同一个幂等键的请求仍在处理中"""
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'expires', 'done', 'response')
+
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.done = threading.Event()
+        self.response = None
+
+
+class IdempotencyCache:
+    """有上限、按时间过期的响应缓存
+
+    claim 登记一个键：第一次出现时返回 None，由调用方执行请求后 complete（或失败时 release）；
+    之后同一个键的请求直接拿到保存的响应。键按登记顺序保存，有效期相同，
+    所以过期和超出 max_keys 时都从最早的一端淘汰；超出 max_keys 时跳过仍在处理的键。
+    hits、misses 为命中缓存和实际执行的次数。
+    """
+
+    def __init__(self, ttl=86400, max_keys=10000, wait=10, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # 同一个键的请求仍在处理时最多等待的秒数
+        self.wait = wait
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def claim(self, key, fingerprint):
+        """登记键，返回保存的响应；键第一次出现（或已过期）时返回 None
+
+        fingerprint 与第一次请求不同时抛出 IdempotencyConflict；
+        第一次请求在 wait 秒内仍未完成时抛出 IdempotencyBusy。
+        """
+        now = self.clock()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = _Entry(fingerprint, now + self.ttl)
+                if len(self._entries) > self.max_keys:
+                    self._evict_completed()
+                self.misses += 1
+                return None
+        if entry.fingerprint != fingerprint:
+            raise IdempotencyConflict("幂等键已用于其他请求")
+        if not entry.done.wait(self.wait):
+            raise IdempotencyBusy("相同的请求正在处理中，请稍后重试")
+        if entry.response is None:
+            # 第一次请求失败后被释放，按新请求重新登记
+            return self.claim(key, fingerprint)
+        with self._lock:
+            self.hits += 1
+        return entry.response
+
+    def complete(self, key, response):
+        """保存键对应的响应，唤醒等待的重复请求"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            entry.response = response
+            entry.done.set()
+
+    def release(self, key):
+        """请求失败，不保存响应；之后同一个键可以重新执行"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    def _evict(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires > now:
+                break
+            self._entries.popitem(last=False)
+            entry.done.set()
+
+    def _evict_completed(self):
+        """淘汰最早的一个已完成的键；仍在处理的键不淘汰，否则重复请求会再执行一次"""
+        for key, entry in self._entries.items():
+            if entry.done.is_set():
+                del self._entries[key]
+                return
+
+    def metrics(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "keys": len(self._entries)}
+
+
+class SharedIdempotencyCache:
+    """保存在共享存储中的幂等键，接口与 IdempotencyCache 相同，供多进程部署使用
+
+    登记在存储事务内完成，同一个键在各进程中只有第一个请求执行；处理中的键由
+    其他进程轮询等待。每个进程按登记顺序记住自己创建的键，过期或超出 max_keys
+    时从存储中删除。时间使用系统时钟，以便各进程比较。
+    """
+
+    def __init__(self, store, collection='idempotencyKeys', ttl=86400, max_keys=10000, wait=10,
+                 clock=time.time, poll_interval=0.05):
+        self.store = store
+        self.collection = collection
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait = wait
+        self.clock = clock
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+        # 本进程创建的键 -> 过期时间
+        self._owned = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._owned)
+
+    def claim(self, key, fingerprint):
+        """登记键，返回保存的响应；键第一次出现（或已过期）时返回 None"""
+        self._evict(self.clock())
+        deadline = self.clock() + self.wait
+        while True:
+            now = self.clock()
+            with self.store.transaction(self.collection):
+                record = self.store.get(self.collection, key)
+                if record is None or record['expiresAt'] <= now:
+                    self.store.put(self.collection, key,
+                                   {'fingerprint': fingerprint, 'expiresAt': now + self.ttl, 'response': None})
+                    with self._lock:
+                        self._owned.pop(key, None)
+                        self._owned[key] = now + self.ttl
+                        self.misses += 1
+                    return None
+            if record['fingerprint'] != fingerprint:
+                raise IdempotencyConflict("幂等键已用于其他请求")
+            if record['response'] is not None:
+                with self._lock:
+                    self.hits += 1
+                body, status = record['response']
+                return body.encode('utf-8'), status
+            if now >= deadline:
+                raise IdempotencyBusy("相同的请求正在处理中，请稍后重试")
+            time.sleep(self.poll_interval)
+
+    def complete(self, key, response):
+        """保存键对应的响应，其他进程中等待的重复请求轮询时取得"""
+        body, status = response
+        with self.store.transaction(self.collection):
+            record = self.store.get(self.collection, key)
+            if record is not None:
+                self.store.put(self.collection, key, {**record, 'response': [body.decode('utf-8'), status]})
+
+    def release(self, key):
+        """请求失败，删除登记；之后同一个键可以重新执行"""
+        with self._lock:
+            self._owned.pop(key, None)
+        self.store.delete(self.collection, key)
+
+    def _evict(self, now):
+        expired = []
+        with self._lock:
+            while self._owned:
+                key, expires = next(iter(self._owned.items()))
+                if expires > now and len(self._owned) <= self.max_keys:
+                    break
+                self._owned.popitem(last=False)
+                expired.append((key, expires))
+        if not expired:
+            return
+        pending = []
+        with self.store.transaction(self.collection):
+            for key, expires in expired:
+                # 过期后可能已被其他进程重新登记，只删除自己登记的那一条
+                record = self.store.get(self.collection, key)
+                if record is None or record['expiresAt'] != expires:
+                    continue
+                if record['response'] is None and expires > now:
+                    # 仍在处理的键不淘汰，否则重复请求会再执行一次
+                    pending.append((key, expires))
+                    continue
+                self.store.delete(self.collection, key)
+        if pending:
+            with self._lock:
+                for key, expires in pending:
+                    self._owned.setdefault(key, expires)
+
+    def metrics(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "keys": len(self._owned)}
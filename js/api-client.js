@@ -13,16 +13,23 @@ class ApiClient {
         this.baseUrl = baseUrl || configured || origin;
         this.cache = {};
         this.cacheTimeout = 5000;
+        // GET响应的ETag和正文，按URL保存，用于条件请求
+        this.etags = new Map();
+        this.maxEtags = 100;
     }
 
     /**
      * 基础请求方法
+     * GET请求带上次的ETag发送 If-None-Match，服务器返回304时直接使用上次的正文
      */
     async request(endpoint, options = {}) {
         const url = `${this.baseUrl}${endpoint}`;
+        const isGet = (options.method || 'GET').toUpperCase() === 'GET';
+        const cached = isGet ? this.etags.get(url) : null;
         const defaultOptions = {
             headers: {
                 'Content-Type': 'application/json',
+                ...(cached ? { 'If-None-Match': cached.etag } : {}),
             },
         };
 
@@ -35,11 +42,51 @@ class ApiClient {
             },
         });
 
+        if (response.status === 304 && cached) {
+            this.etags.delete(url);
+            this.etags.set(url, cached);
+            return JSON.parse(cached.body);
+        }
+
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
-        return await response.json();
+        const body = await response.text();
+        const etag = response.headers.get('ETag');
+        if (isGet && etag) {
+            // 按最近使用排序，超出上限时淘汰最久未用的
+            this.etags.delete(url);
+            this.etags.set(url, { etag, body });
+            if (this.etags.size > this.maxEtags) {
+                this.etags.delete(this.etags.keys().next().value);
+            }
+        }
+        return JSON.parse(body);
+    }
+
+    /**
+     * 带幂等键的POST请求
+     * 网络错误或5xx时用同一个 Idempotency-Key 重试，服务器对重复请求返回第一次的结果，不会重复记账
+     */
+    async idempotentPost(endpoint, body, retries = 2) {
+        const key = (typeof crypto !== 'undefined' && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        for (let attempt = 0; ; attempt++) {
+            try {
+                return await this.request(endpoint, {
+                    method: 'POST',
+                    headers: { 'Idempotency-Key': key },
+                    body: JSON.stringify(body),
+                });
+            } catch (error) {
+                const status = Number((/status: (\d+)/.exec(error.message) || [])[1]);
+                const retryable = !status || status >= 500 || status === 409;
+                if (!retryable || attempt >= retries) throw error;
+                await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+            }
+        }
     }
 
     /**
@@ -77,6 +124,29 @@ class ApiClient {
         }
     }
 
+    /**
+     * 局部更新数据
+     * 默认 patch 为 RFC 6902 JSON Patch 操作数组，merge 为 true 时为 RFC 7396 Merge Patch；
+     * 给出 version（数据版本）时，该版本之后相关集合被他人修改过则服务器返回412
+     */
+    async patchData(patch, { merge = false, version = null } = {}) {
+        try {
+            const result = await this.request('/api/data', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': merge ? 'application/merge-patch+json' : 'application/json-patch+json',
+                    ...(version ? { 'If-Match': `"${version}"` } : {}),
+                },
+                body: JSON.stringify(patch),
+            });
+            this.clearCache();
+            return result;
+        } catch (error) {
+            console.error('局部更新数据失败:', error);
+            throw error;
+        }
+    }
+
     /**
      * 获取捐款记录
      */
@@ -100,10 +170,7 @@ class ApiClient {
      */
     async addDonation(donation) {
         try {
-            const result = await this.request('/api/donations', {
-                method: 'POST',
-                body: JSON.stringify(donation),
-            });
+            const result = await this.idempotentPost('/api/donations', donation);
             this.clearCache();
             return result;
         } catch (error) {
@@ -177,12 +244,9 @@ class ApiClient {
 
     async depositToWallet(userId, amount) {
         try {
-            const result = await this.request('/api/wallet/deposit', {
-                method: 'POST',
-                body: JSON.stringify({
-                    user_id: userId,
-                    amount: amount
-                }),
+            const result = await this.idempotentPost('/api/wallet/deposit', {
+                user_id: userId,
+                amount: amount
             });
             this.clearCache();
             return result;
@@ -194,12 +258,9 @@ class ApiClient {
 
     async withdrawFromWallet(userId, amount) {
         try {
-            const result = await this.request('/api/wallet/withdraw', {
-                method: 'POST',
-                body: JSON.stringify({
-                    user_id: userId,
-                    amount: amount
-                }),
+            const result = await this.idempotentPost('/api/wallet/withdraw', {
+                user_id: userId,
+                amount: amount
             });
             this.clearCache();
             return result;
@@ -209,9 +270,13 @@ class ApiClient {
         }
     }
 
-    async getWalletTransactions(userId, limit = 50) {
+    // cursor: { before } 取更早的一页，{ after } 取更新的一页，取自上次结果的 cursors
+    async getWalletTransactions(userId, limit = 50, cursor = {}) {
         try {
-            const result = await this.request(`/api/wallet/transactions/${userId}?limit=${limit}`);
+            const params = new URLSearchParams({ limit });
+            if (cursor.before !== undefined && cursor.before !== null) params.set('before', cursor.before);
+            if (cursor.after !== undefined && cursor.after !== null) params.set('after', cursor.after);
+            const result = await this.request(`/api/wallet/transactions/${userId}?${params}`);
             return result;
         } catch (error) {
             console.error('获取钱包交易记录失败:', error);
@@ -236,6 +301,11 @@ class ApiClient {
         }
     }
 
+    // 只取捐款笔数和总额，不返回记录
+    async getUserDonationSummary(userId) {
+        return this.request(`/api/donations/user/${userId}?summary=1`);
+    }
+
     async getUserDonations(userId) {
         try {
             const result = await this.request(`/api/donations/user/${userId}`);
@@ -264,6 +334,20 @@ class ApiClient {
         }
     }
 
+    /**
+     * 分页查询列表集合（members、donations、applications）
+     * params: limit、cursor、sort（asc/desc）、fields（数组或逗号分隔）以及字段相等条件；
+     * 返回 { [集合]: 记录, count, total, next_cursor }
+     */
+    async queryCollection(name, params = {}) {
+        const query = new URLSearchParams();
+        Object.entries(params).forEach(([key, value]) => {
+            if (value === undefined || value === null) return;
+            query.set(key, Array.isArray(value) ? value.join(',') : value);
+        });
+        return this.request(`/api/${name}?${query}`);
+    }
+
     /**
      * 获取被拒绝的申请列表
      */
@@ -308,19 +392,23 @@ class ApiClient {
             const idx = data.applications.findIndex(a => String(a.id) === String(id));
             if (idx === -1) throw new Error('application_not_found');
             const app = data.applications[idx];
-            app.status = 'approved';
+            // 只提交变化的部分；test 确认该位置仍是这条申请，否则服务器返回409
+            const patch = [
+                { op: 'test', path: `/applications/${idx}/id`, value: app.id },
+                { op: 'add', path: `/applications/${idx}/status`, value: 'approved' },
+            ];
             const exists = data.members.find(m => (m.email||'').toLowerCase() === (app.email||'').toLowerCase());
             if (!exists) {
-                data.members.push({
+                patch.push({ op: 'add', path: '/members/-', value: {
                     id: String(Date.now()),
                     username: app.username || app.fullName || app.email || '',
                     email: app.email || '',
                     realName: app.realName || app.fullName || '',
                     password: app.password || '',
                     joined_at: new Date().toISOString()
-                });
+                } });
             }
-            await this.updateAllData(data);
+            await this.patchData(patch);
             this.clearCache();
             return { success: true };
         } catch (error) {
@@ -336,9 +424,11 @@ class ApiClient {
             const idx = data.applications.findIndex(a => String(a.id) === String(id));
             if (idx === -1) throw new Error('application_not_found');
             const app = data.applications[idx];
-            app.status = 'rejected';
-            app.rejectReason = reason || '无';
-            await this.updateAllData(data);
+            await this.patchData([
+                { op: 'test', path: `/applications/${idx}/id`, value: app.id },
+                { op: 'add', path: `/applications/${idx}/status`, value: 'rejected' },
+                { op: 'add', path: `/applications/${idx}/rejectReason`, value: reason || '无' },
+            ]);
             this.clearCache();
             return { success: true };
         } catch (error) {
@@ -641,9 +731,9 @@ const backendStorage = {
 
     async setItem(key, value) {
         try {
-            const allData = await apiClient.getAllData();
-            allData[key] = JSON.parse(value);
-            await apiClient.updateAllData(allData);
+            // 只提交这一项，不再取回并上传整个文档
+            const path = '/' + key.replace(/~/g, '~0').replace(/\//g, '~1');
+            await apiClient.patchData([{ op: 'add', path, value: JSON.parse(value) }]);
             return true;
         } catch (error) {
             console.error('保存数据失败:', error);
@@ -653,9 +743,7 @@ const backendStorage = {
 
     async removeItem(key) {
         try {
-            const allData = await apiClient.getAllData();
-            delete allData[key];
-            await apiClient.updateAllData(allData);
+            await apiClient.patchData({ [key]: null }, { merge: true });
             return true;
         } catch (error) {
             console.error('删除数据失败:', error);
@@ -680,11 +768,18 @@ const backendStorage = {
 
 /**
  * 数据同步管理器
+ * 订阅服务器的变更推送（/api/changes），按本地数据版本只拉取增量（/api/data?since=）；
+ * 浏览器不支持 EventSource 或推送连接被关闭时退回定时轮询
  */
 class DataSyncManager {
     constructor() {
-        this.syncInterval = 30000; // 30秒同步一次
+        this.syncInterval = 30000; // 轮询模式下30秒同步一次
         this.isSyncing = false;
+        this.syncAgain = false;
+        this.eventSource = null;
+        this.pollTimer = null;
+        this.pendingTimer = null;
+        this.versionKey = 'dataSyncVersion'; // localStorage 中数据对应的服务器版本
         this.startAutoSync();
     }
 
@@ -692,36 +787,151 @@ class DataSyncManager {
      * 开始自动同步
      */
     startAutoSync() {
-        setInterval(() => {
+        if (typeof EventSource === 'undefined') {
+            this.startPolling();
+            return;
+        }
+        this.subscribe();
+    }
+
+    startPolling() {
+        if (this.pollTimer) return;
+        this.pollTimer = setInterval(() => {
             this.syncAllData();
         }, this.syncInterval);
     }
 
+    stopPolling() {
+        if (!this.pollTimer) return;
+        clearInterval(this.pollTimer);
+        this.pollTimer = null;
+    }
+
+    /**
+     * 订阅变更推送；断线后浏览器自动重连并补发错过的变更
+     */
+    subscribe() {
+        const source = new EventSource(`${apiClient.baseUrl}/api/changes`);
+        this.eventSource = source;
+
+        source.addEventListener('change', () => {
+            this.scheduleSync();
+        });
+        source.addEventListener('reset', () => {
+            this.syncAllData();
+        });
+        source.onopen = () => {
+            this.stopPolling();
+        };
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                this.eventSource = null;
+                this.startPolling();
+            }
+        };
+    }
+
+    /**
+     * 合并短时间内的多次变更，统一同步一次
+     */
+    scheduleSync() {
+        if (this.pendingTimer) return;
+        this.pendingTimer = setTimeout(() => {
+            this.pendingTimer = null;
+            this.syncAllData();
+        }, 300);
+    }
+
     /**
-     * 同步所有数据
+     * 同步所有数据：有本地版本时只拉取并应用增量
      */
     async syncAllData() {
-        if (this.isSyncing) return;
+        if (this.isSyncing) {
+            this.syncAgain = true;
+            return;
+        }
         
         this.isSyncing = true;
         try {
             console.log('开始数据同步...');
             
-            // 从后端获取最新数据
-            const serverData = await apiClient.getAllData();
+            const since = localStorage.getItem(this.versionKey) || '0';
+            const result = await apiClient.request(`/api/data?since=${encodeURIComponent(since)}`);
             
             // 更新本地localStorage
-            for (const [key, value] of Object.entries(serverData)) {
-                if (value !== null && value !== undefined) {
-                    localStorage.setItem(key, JSON.stringify(value));
-                }
-            }
+            const collections = result.full ? this.applyFull(result.data) : this.applyChanges(result.changes);
+            localStorage.setItem(this.versionKey, result.version);
             
+            if (collections.length) {
+                apiClient.clearCache();
+                this.notify(collections);
+            }
             console.log('数据同步完成');
         } catch (error) {
             console.error('数据同步失败:', error);
         } finally {
             this.isSyncing = false;
+            if (this.syncAgain) {
+                this.syncAgain = false;
+                this.syncAllData();
+            }
+        }
+    }
+
+    applyFull(serverData) {
+        for (const [key, value] of Object.entries(serverData)) {
+            if (value !== null && value !== undefined) {
+                localStorage.setItem(key, JSON.stringify(value));
+            }
+        }
+        return Object.keys(serverData);
+    }
+
+    /**
+     * 把增量合并进localStorage：列表集合按 id 更新或追加记录，字典集合按键写入或删除
+     */
+    applyChanges(changes) {
+        for (const [name, change] of Object.entries(changes)) {
+            if ('replace' in change) {
+                localStorage.setItem(name, JSON.stringify(change.replace));
+                continue;
+            }
+
+            let value = null;
+            try {
+                value = JSON.parse(localStorage.getItem(name));
+            } catch {}
+
+            const records = Object.values(change.records);
+            if (records.length) {
+                value = Array.isArray(value) ? value : [];
+                const positions = new Map(value.map((record, i) => [String(record && record.id), i]));
+                for (const record of records) {
+                    const i = positions.get(String(record.id));
+                    if (i === undefined) {
+                        positions.set(String(record.id), value.length);
+                        value.push(record);
+                    } else {
+                        value[i] = record;
+                    }
+                }
+            }
+            if (Object.keys(change.items).length || change.deleted.length) {
+                value = value && !Array.isArray(value) && typeof value === 'object' ? value : {};
+                Object.assign(value, change.items);
+                change.deleted.forEach(key => delete value[key]);
+            }
+            localStorage.setItem(name, JSON.stringify(value));
+        }
+        return Object.keys(changes);
+    }
+
+    /**
+     * 通知页面本地数据已更新
+     */
+    notify(collections) {
+        if (typeof window !== 'undefined') {
+            window.dispatchEvent(new CustomEvent('datasync', { detail: { collections } }));
         }
     }
 
@@ -733,12 +943,115 @@ class DataSyncManager {
     }
 }
 
+/**
+ * 在线状态通道
+ * 会员页面 join 后保持一条 WebSocket 连接（/ws/presence），连接期间在线、断开即离线；
+ * 服务器不支持 WebSocket 时退回每30秒一次的HTTP心跳。
+ * 管理后台 watch 后收到全量在线状态和之后的每次上线、下线。
+ */
+class PresenceChannel {
+    constructor() {
+        this.heartbeatInterval = 30000;
+        this.retryDelay = 3000;
+        this.socket = null;
+        this.heartbeatTimer = null;
+        this.presence = {};
+        this.watchers = [];
+    }
+
+    get url() {
+        return apiClient.baseUrl.replace(/^http/, 'ws') + '/ws/presence';
+    }
+
+    /**
+     * 以该用户身份上线
+     */
+    join(username) {
+        if (!username || this.socket || this.heartbeatTimer) return;
+        this.connect({ type: 'join', username }, () => this.startHeartbeat(username));
+    }
+
+    /**
+     * 订阅在线状态，callback(在线状态表) 在每次变化后调用
+     */
+    watch(callback) {
+        this.watchers.push(callback);
+        if (this.watchers.length > 1) {
+            callback(this.presence);
+            return;
+        }
+        this.connect({ type: 'watch' }, () => this.pollPresence());
+    }
+
+    connect(hello, fallback) {
+        if (typeof WebSocket === 'undefined') {
+            fallback();
+            return;
+        }
+        let opened = false;
+        const socket = new WebSocket(this.url);
+        this.socket = socket;
+        socket.onopen = () => {
+            opened = true;
+            socket.send(JSON.stringify(hello));
+        };
+        socket.onmessage = (event) => {
+            const message = JSON.parse(event.data);
+            if (message.type === 'snapshot') {
+                this.presence = message.presence || {};
+            } else if (message.type === 'presence') {
+                if (message.presence) {
+                    this.presence[message.username] = message.presence;
+                } else {
+                    delete this.presence[message.username];
+                }
+            } else {
+                return;
+            }
+            this.notify();
+        };
+        socket.onclose = () => {
+            this.socket = null;
+            if (opened) {
+                // 连接曾建立过，稍后重连
+                setTimeout(() => this.connect(hello, fallback), this.retryDelay);
+            } else {
+                // 握手失败说明服务器不支持 WebSocket
+                fallback();
+            }
+        };
+    }
+
+    startHeartbeat(username) {
+        if (this.heartbeatTimer) return;
+        const beat = () => apiClient.updateUserPresence(username, true).catch(() => {});
+        beat();
+        this.heartbeatTimer = setInterval(beat, this.heartbeatInterval);
+    }
+
+    pollPresence() {
+        if (this.heartbeatTimer) return;
+        const poll = async () => {
+            this.presence = await apiClient.getUserPresence();
+            this.notify();
+        };
+        poll();
+        this.heartbeatTimer = setInterval(poll, this.heartbeatInterval);
+    }
+
+    notify() {
+        this.watchers.forEach(callback => callback(this.presence));
+    }
+}
+
 // 创建数据同步管理器实例
 const dataSyncManager = new DataSyncManager();
+const presenceChannel = new PresenceChannel();
 
 /**
      * 导出供全局使用的函数
      */
 window.apiClient = apiClient;
 window.backendStorage = backendStorage;
-window.dataSyncManager = dataSyncManager;
\ No newline at end of file
+window.dataSyncManager = dataSyncManager;
+window.presenceChannel = presenceChannel;
\ No newline at end of file
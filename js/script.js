@@ -619,17 +619,22 @@ function handleAdminLogin() {
 async function loadAdminData() {
     try {
         if (window.apiClient) {
-            const [pendingApplications, approvedMembers, rejectedApplications] = await Promise.all([
-                window.apiClient.getApplications(),
-                window.apiClient.getMembers(),
-                window.apiClient.getRejectedApplications(),
+            // 待审核申请只取一页，且不带密码等字段；会员和被拒绝的申请只取总数
+            const [pending, members, rejected] = await Promise.all([
+                window.apiClient.queryCollection('applications', {
+                    status: 'pending',
+                    limit: 50,
+                    fields: ['id', 'realName', 'username', 'email', 'phone', 'city', 'submitTime', 'interests', 'reason'],
+                }),
+                window.apiClient.queryCollection('members', { limit: 0 }),
+                window.apiClient.queryCollection('applications', { status: 'rejected', limit: 0 }),
             ]);
 
-            document.getElementById('pendingCount').textContent = pendingApplications.length;
-            document.getElementById('approvedCount').textContent = approvedMembers.length;
-            document.getElementById('rejectedCount').textContent = rejectedApplications.length;
+            document.getElementById('pendingCount').textContent = pending.total;
+            document.getElementById('approvedCount').textContent = members.total;
+            document.getElementById('rejectedCount').textContent = rejected.total;
 
-            loadPendingApplications(pendingApplications);
+            loadPendingApplications(pending.applications);
         } else {
             console.error('apiClient不可用');
             alert('无法加载管理数据，请刷新页面或联系技术支持');
@@ -1552,6 +1557,11 @@ document.addEventListener('DOMContentLoaded', function() {
     if (document.getElementById('chatPage')) {
         initChatPage();
     }
+    // 已登录会员保持在线状态连接，关闭页面即离线
+    const user = getCurrentUser();
+    if (user && window.presenceChannel) {
+        window.presenceChannel.join(user.username);
+    }
 });
 
 let whacTimer = null;
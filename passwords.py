@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+密码哈希 - PBKDF2-SHA256，计算放在有界进程池中执行，不占用请求线程的CPU
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+ALGORITHM = 'pbkdf2_sha256'
+
+
+class HasherBusy(RuntimeError):
+    """排队的哈希任务已达上限"""
+
+
+def hash_password(password, iterations):
+    """返回 pbkdf2_sha256$<迭代次数>$<盐>$<哈希>"""
+    salt = os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), iterations)
+    return f"{ALGORITHM}${iterations}${salt}${digest.hex()}"
+
+
+def _hash_chunk(passwords, iterations):
+    return [hash_password(password, iterations) for password in passwords]
+
+
+def verify_password(password, stored):
+    """校验密码，返回 (是否正确, 迭代次数)；旧的明文密码迭代次数为 0"""
+    if not isinstance(stored, str) or not stored.startswith(ALGORITHM + '$'):
+        # 旧数据中的明文密码
+        return hmac.compare_digest(str(password).encode('utf-8'), str(stored).encode('utf-8')), 0
+    _, iterations, salt, expected = stored.split('$', 3)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('ascii'), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected), int(iterations)
+
+
+class PasswordHasher:
+    """在进程池中计算密码哈希
+
+    同时执行和排队的任务合计不超过 workers + max_queue，超出时立即抛出 HasherBusy，
+    由调用方返回503，避免高峰期请求线程全部堵在排队上。workers 为 0 时在当前线程计算。
+
+    子进程以 fork 方式创建，应在启动任何后台线程之前调用 start()，一次创建全部子进程，
+    以免子进程继承其他线程持有的锁。
+    """
+
+    def __init__(self, workers=2, max_queue=32, iterations=200000):
+        self.workers = workers
+        self.iterations = iterations
+        # 因排队已满被拒绝的次数
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers else None
+        self._pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+
+    def start(self):
+        """立即创建全部子进程"""
+        if self._pool is not None:
+            for future in [self._pool.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+        return self
+
+    def _run(self, fn, *args):
+        if self._pool is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy("服务器繁忙，请稍后重试")
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.iterations)
+
+    def hash_many(self, passwords, chunk=32):
+        """批量哈希，按顺序返回结果
+
+        密码分块后同时提交，最多 workers 块在进程池中并行，每块占一个排队名额，
+        其余名额留给登录请求。一个名额都取不到时抛出 HasherBusy。
+        """
+        if self._pool is None:
+            return _hash_chunk(passwords, self.iterations)
+        # 块数至少与进程数相同，所有进程都能分到
+        chunk = max(1, min(chunk, -(-len(passwords) // self.workers)))
+        chunks = [passwords[start:start + chunk] for start in range(0, len(passwords), chunk)]
+        futures = []
+        pending = deque()
+        try:
+            for part in chunks:
+                # 已有 workers 块在执行，或名额被登录占满时，先等最早的一块完成
+                while len(pending) >= self.workers or not self._slots.acquire(blocking=False):
+                    if not pending:
+                        self.rejected += 1
+                        raise HasherBusy("服务器繁忙，请稍后重试")
+                    self._release_when_done(pending.popleft())
+                future = self._pool.submit(_hash_chunk, part, self.iterations)
+                futures.append(future)
+                pending.append(future)
+            hashes = []
+            for future in futures:
+                hashes.extend(future.result())
+            return hashes
+        finally:
+            while pending:
+                self._release_when_done(pending.popleft())
+
+    def _release_when_done(self, future):
+        try:
+            future.exception()
+        finally:
+            self._slots.release()
+
+    def verify(self, password, stored):
+        """校验密码，返回 (是否正确, 是否需要重新哈希)
+
+        明文或迭代次数低于当前设置的密码在校验通过后需要重新哈希。
+        """
+        if not isinstance(password, str) or stored is None:
+            return False, False
+        if isinstance(stored, str) and stored.startswith(ALGORITHM + '$'):
+            ok, iterations = self._run(verify_password, password, stored)
+        else:
+            # 明文比较不需要进程池
+            ok, iterations = verify_password(password, stored)
+        return ok, ok and iterations < self.iterations
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON补丁 - RFC 6902 JSON Patch 与 RFC 7396 JSON Merge Patch
+
+应用补丁时不修改传入的文档：只复制补丁路径上经过的容器，其余部分与原文档共用，
+调用方据此按对象身份找出真正变化的集合和记录。
+"""
+
+import copy
+
+
+class PatchError(ValueError):
+    """补丁格式不正确或路径不存在"""
+
+
+class PatchConflict(PatchError):
+    """test 操作不成立"""
+
+
+def parse_pointer(pointer):
+    """把 JSON Pointer 拆成各级键"""
+    if pointer == '':
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith('/'):
+        raise PatchError(f"无效的路径: {pointer}")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def touched_collections(patch, merge=False):
+    """补丁涉及的顶层集合；涉及整个文档或删除顶层集合时返回 None"""
+    if merge:
+        if not isinstance(patch, dict) or any(value is None for value in patch.values()):
+            return None
+        return set(patch)
+    if not isinstance(patch, list):
+        raise PatchError("JSON Patch 必须是操作数组")
+    names = set()
+    for op in patch:
+        if not isinstance(op, dict):
+            raise PatchError("JSON Patch 操作必须是对象")
+        for field in ('path', 'from'):
+            if field in op:
+                tokens = parse_pointer(op[field])
+                removed = op.get('op') == 'remove' or (op.get('op') == 'move' and field == 'from')
+                if not tokens or (len(tokens) == 1 and removed):
+                    return None
+                names.add(tokens[0])
+    return names
+
+
+def _json_equal(a, b):
+    """按JSON语义比较：类型必须一致（Python 中 1 == True）"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_json_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+class _Patcher:
+    def __init__(self, doc):
+        self.doc = doc
+        # 本次已复制过的容器，可以直接修改
+        self._owned = set()
+
+    @staticmethod
+    def _index(node, token, allow_end=False):
+        if token == '-' and allow_end:
+            return len(node)
+        if not token.isdigit() or (token != '0' and token.startswith('0')):
+            raise PatchError(f"无效的数组下标: {token}")
+        index = int(token)
+        if index > len(node) or (index == len(node) and not allow_end):
+            raise PatchError(f"数组下标越界: {token}")
+        return index
+
+    def get(self, tokens):
+        node = self.doc
+        for token in tokens:
+            if isinstance(node, dict):
+                if token not in node:
+                    raise PatchError(f"路径不存在: /{'/'.join(tokens)}")
+                node = node[token]
+            elif isinstance(node, list):
+                node = node[self._index(node, token)]
+            else:
+                raise PatchError(f"路径不存在: /{'/'.join(tokens)}")
+        return node
+
+    def _own(self, value):
+        if id(value) in self._owned:
+            return value
+        value = copy.copy(value)
+        self._owned.add(id(value))
+        return value
+
+    def parent(self, tokens):
+        """取路径的父容器，沿途复制以免改动原文档"""
+        self.doc = node = self._own(self.doc)
+        for token in tokens[:-1]:
+            if isinstance(node, dict):
+                if token not in node:
+                    raise PatchError(f"路径不存在: /{'/'.join(tokens)}")
+                key = token
+            elif isinstance(node, list):
+                key = self._index(node, token)
+            else:
+                raise PatchError(f"路径不存在: /{'/'.join(tokens)}")
+            child = node[key]
+            if not isinstance(child, (dict, list)):
+                raise PatchError(f"路径不存在: /{'/'.join(tokens)}")
+            node[key] = node = self._own(child)
+        return node
+
+    def add(self, tokens, value):
+        if not tokens:
+            self.doc = value
+            return
+        node = self.parent(tokens)
+        if isinstance(node, list):
+            node.insert(self._index(node, tokens[-1], allow_end=True), value)
+        else:
+            node[tokens[-1]] = value
+
+    def remove(self, tokens):
+        if not tokens:
+            raise PatchError("不能删除整个文档")
+        node = self.parent(tokens)
+        if isinstance(node, list):
+            return node.pop(self._index(node, tokens[-1]))
+        if tokens[-1] not in node:
+            raise PatchError(f"路径不存在: /{'/'.join(tokens)}")
+        return node.pop(tokens[-1])
+
+    def replace(self, tokens, value):
+        if not tokens:
+            self.doc = value
+            return
+        self.get(tokens)
+        node = self.parent(tokens)
+        if isinstance(node, list):
+            node[self._index(node, tokens[-1])] = value
+        else:
+            node[tokens[-1]] = value
+
+
+def apply_json_patch(doc, patch):
+    """应用 RFC 6902 JSON Patch，返回新文档"""
+    if not isinstance(patch, list):
+        raise PatchError("JSON Patch 必须是操作数组")
+    patcher = _Patcher(doc)
+    for op in patch:
+        if not isinstance(op, dict) or 'op' not in op or 'path' not in op:
+            raise PatchError(f"无效的补丁操作: {op}")
+        kind, path = op['op'], parse_pointer(op['path'])
+        if kind in ('add', 'replace', 'test') and 'value' not in op:
+            raise PatchError(f"{kind} 操作缺少 value")
+        if kind in ('move', 'copy') and 'from' not in op:
+            raise PatchError(f"{kind} 操作缺少 from")
+
+        if kind == 'add':
+            patcher.add(path, op['value'])
+        elif kind == 'remove':
+            patcher.remove(path)
+        elif kind == 'replace':
+            patcher.replace(path, op['value'])
+        elif kind == 'move':
+            source = parse_pointer(op['from'])
+            if path[:len(source)] == source and path != source:
+                raise PatchError("不能把节点移动到它自己的子节点下")
+            patcher.add(path, patcher.remove(source))
+        elif kind == 'copy':
+            patcher.add(path, copy.deepcopy(patcher.get(parse_pointer(op['from']))))
+        elif kind == 'test':
+            if not _json_equal(patcher.get(path), op['value']):
+                raise PatchConflict(f"test 不成立: {op['path']}")
+        else:
+            raise PatchError(f"未知的补丁操作: {kind}")
+    return patcher.doc
+
+
+def apply_merge_patch(target, patch):
+    """应用 RFC 7396 JSON Merge Patch，返回新文档"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+在线状态 - 常驻内存，不写数据文件
+
+WebSocket 连接建立即在线、全部断开即离线；不支持 WebSocket 的浏览器退回HTTP心跳。
+每个进程维护自己的连接；多进程部署时给出共享存储，各进程定期把自己的在线状态
+写入其中，读取时合并所有进程的状态。
+"""
+
+import atexit
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from expiry import ExpiryQueue
+
+
+class PresenceRegistry:
+    """用户在线状态表
+
+    listeners 中的函数在在线状态变化时被调用，签名与存储的监听函数一致：
+    listener(collection, kind, key, value)，kind 为 put（上线、下线）或 delete（移除）。
+    心跳只刷新最后活跃时间，不发通知，但 version 每次状态变化（含心跳）都加一，
+    用于生成包含最后活跃时间的响应的ETag。
+    给出 timeout（秒）时，没有连接且超过 timeout 不活跃的用户到期移除。
+
+    给出 store（共享模式的存储）时，本进程的状态在上线、下线时立即、其余每 sync_interval 秒
+    写入 store 的 workers_collection，键为本进程的标识。snapshot 合并存储中各进程的状态：
+    任一进程在线即在线，最后活跃时间取最新的；本进程的变化在写入后可见。
+    version 取存储的修改序号，各进程一致。通知按合并后的状态发出，
+    其他进程的变化在 refresh() 时发现。超过 3 个同步间隔未更新的进程视为已退出并移除。
+    """
+
+    def __init__(self, collection='userPresence', timeout=None, store=None,
+                 workers_collection='presenceWorkers', sync_interval=5):
+        self.collection = collection
+        self.timeout = timeout
+        self.listeners = []
+        self._version = 0
+        self.store = store
+        self.workers_collection = workers_collection
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._entries = {}
+        self._expiry = ExpiryQueue(self._expire) if timeout else None
+        # 共享模式：本进程标识、上次通知时的合并状态、需要重新合并的标记
+        self._worker = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._merged = {}
+        self._merge_lock = threading.Lock()
+        self._remote_changed = False
+        self._flipped = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        if store is not None:
+            store.listeners.append(self._store_changed)
+
+    @property
+    def version(self):
+        return self.store.seq if self.store is not None else self._version
+
+    def start(self):
+        """启动到期清理线程；共享模式下还启动同步线程"""
+        if self._expiry is not None:
+            self._expiry.start()
+        if self.store is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._sync_loop, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def connect(self, username):
+        """一个连接建立"""
+        with self._lock:
+            self._connections[username] = self._connections.get(username, 0) + 1
+            return self._set(username, True)
+
+    def disconnect(self, username):
+        """一个连接断开，该用户没有其他连接时标记离线"""
+        with self._lock:
+            count = self._connections.get(username, 0) - 1
+            if count > 0:
+                self._connections[username] = count
+                return self._entries[username]
+            self._connections.pop(username, None)
+            return self._set(username, False)
+
+    def touch(self, username, online=True):
+        """HTTP心跳；仍有连接的用户不会因心跳标记离线"""
+        with self._lock:
+            return self._set(username, online or username in self._connections)
+
+    def remove(self, username):
+        """移除一个没有连接的用户，返回被移除的状态"""
+        with self._lock:
+            if username in self._connections:
+                return None
+            entry = self._entries.pop(username, None)
+            if self._expiry is not None:
+                self._expiry.cancel(username)
+            if entry is not None:
+                self._version += 1
+                self._notify('delete', username)
+            return entry
+
+    def get(self, username, default=None):
+        return self.snapshot().get(username, default)
+
+    def snapshot(self):
+        """全部用户的在线状态"""
+        if self.store is not None:
+            return self._merge()
+        with self._lock:
+            return dict(self._entries)
+
+    def refresh(self):
+        """共享模式下同步其他进程的状态，合并后的上线、下线经 listeners 通知"""
+        if self.store is None:
+            return
+        self.store.refresh()
+        if self._remote_changed:
+            self._merge_and_notify()
+
+    def _expire(self, username):
+        with self._lock:
+            # 到期后又有心跳或连接时不移除
+            if username in self._connections or username in self._expiry:
+                return
+            if self._entries.pop(username, None) is not None:
+                self._version += 1
+                self._notify('delete', username)
+
+    def _set(self, username, online):
+        previous = self._entries.get(username)
+        entry = self._entries[username] = {'online': online, 'lastActive': datetime.now().isoformat()}
+        self._version += 1
+        if self._expiry is not None:
+            if username in self._connections:
+                self._expiry.cancel(username)
+            else:
+                self._expiry.schedule(username, time.time() + self.timeout)
+        if previous is None or previous['online'] != online:
+            self._notify('put', username, entry)
+        return entry
+
+    def _notify(self, kind, username, entry=None):
+        if self.store is not None:
+            # 共享模式：尽快写入存储，由合并后的状态决定是否通知
+            self._flipped.set()
+            return
+        # 在锁内调用，保证通知顺序与状态变化顺序一致
+        for listener in self.listeners:
+            listener(self.collection, kind, username, entry)
+
+    # 共享模式
+
+    def _store_changed(self, collection, kind, key=None, value=None):
+        # 在存储同步其他进程的修改时调用，此时持有存储的锁，只做标记
+        if collection is None or (collection == self.workers_collection and key != self._worker):
+            self._remote_changed = True
+
+    def _merge(self):
+        merged = {}
+        for worker in (self.store.all(self.workers_collection) or {}).values():
+            for username, entry in worker.get('entries', {}).items():
+                current = merged.get(username)
+                if current is None:
+                    merged[username] = dict(entry)
+                    continue
+                current['online'] = current['online'] or entry['online']
+                current['lastActive'] = max(current['lastActive'], entry['lastActive'])
+        return merged
+
+    def _merge_and_notify(self):
+        with self._merge_lock:
+            self._remote_changed = False
+            merged = self.snapshot()
+            previous, self._merged = self._merged, merged
+            for username, entry in merged.items():
+                old = previous.get(username)
+                if old is None or old['online'] != entry['online']:
+                    for listener in self.listeners:
+                        listener(self.collection, 'put', username, entry)
+            for username in previous.keys() - merged.keys():
+                for listener in self.listeners:
+                    listener(self.collection, 'delete', username, None)
+
+    def sync(self):
+        """把本进程的状态写入共享存储，清理已退出的进程，并合并通知"""
+        self._flipped.clear()
+        with self._lock:
+            local = dict(self._entries)
+        now = time.time()
+        with self.store.transaction(self.workers_collection):
+            self.store.put(self.workers_collection, self._worker, {'updatedAt': now, 'entries': local})
+            for worker, record in (self.store.all(self.workers_collection) or {}).items():
+                if record.get('updatedAt', 0) < now - 3 * self.sync_interval:
+                    self.store.delete(self.workers_collection, worker)
+        self.refresh()
+        self._merge_and_notify()
+
+    def _sync_loop(self):
+        while not self._stopped.is_set():
+            self._flipped.wait(self.sync_interval)
+            if self._stopped.is_set():
+                break
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"同步在线状态失败: {e}")
+
+    def close(self):
+        """停止同步线程并从共享存储中移除本进程"""
+        if self.store is None or self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._flipped.set()
+        try:
+            self.store.delete(self.workers_collection, self._worker)
+        except Exception as e:
+            print(f"移除在线状态失败: {e}")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+限流 - 内存中按键（IP、账号）维护的令牌桶
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """令牌桶限流器
+
+    每个键一个桶，容量 burst，每秒补充 rate 个令牌。只保留最近使用的 max_keys 个桶，
+    超出时淘汰最久未用的（被淘汰的键下次按满桶计算）。allowed、shed 为放行和拒绝的次数。
+    """
+
+    def __init__(self, rate, burst, max_keys=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.allowed = 0
+        self.shed = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
+
+    def acquire(self, key, cost=1):
+        """取令牌，返回 (是否放行, 需等待的秒数)"""
+        now = self.clock()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                self.allowed += 1
+                wait = 0.0
+            else:
+                self.shed += 1
+                wait = (cost - tokens) / self.rate if self.rate else float('inf')
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait == 0.0, wait
+
+    def metrics(self):
+        with self._lock:
+            return {"allowed": self.allowed, "shed": self.shed, "keys": len(self._buckets)}
@@ -5,98 +5,693 @@
 使用Flask框架提供RESTful API接口
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, make_response, send_from_directory
 from flask_cors import CORS
+import functools
+import hashlib
+import math
+from collections import OrderedDict
 import json
 import os
 from datetime import datetime
-import threading
 import time
 import random
 import string
 import re
+import threading
+
+from changefeed import ChangeFeed
+from compression import compress, compress_stream, compressible, negotiate
+from idempotency import IdempotencyBusy, IdempotencyCache, IdempotencyConflict, SharedIdempotencyCache
+from passwords import HasherBusy, PasswordHasher
+from presence import PresenceRegistry
+from ratelimit import TokenBucketLimiter
+from sessions import SessionStore
+from patches import PatchConflict, apply_json_patch, apply_merge_patch, touched_collections
+from storage import JsonStore, SqliteStore, SQLITE_TABLES, get_codec, group_writer, iter_json
+
+try:
+    from flask_sock import Sock
+except ImportError:  # 未安装 flask-sock 时在线状态只能走HTTP心跳
+    Sock = None
 
 app = Flask(__name__)
-CORS(app)  # 启用跨域支持
+CORS(app, expose_headers=['ETag', 'X-Data-Version', 'Idempotent-Replayed'])  # 启用跨域支持，允许前端读取ETag、数据版本和幂等重放标记
 
 # 数据文件路径
 DATA_FILE = 'data.json'
 USERS_FILE = 'users.json'
 
-# 全局数据锁，确保线程安全
-data_lock = threading.Lock()
+# 数据按集合分片保存的目录，留空则整体保存在 data.json 中
+DATA_SHARD_DIR = os.environ.get('STORE_SHARD_DIR', 'data.d') or None
 
-def load_json_data(filename, default_data=None):
-    """安全加载JSON数据"""
-    if default_data is None:
-        default_data = {}
-    
-    try:
-        if os.path.exists(filename):
-            with data_lock:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-    except Exception as e:
-        print(f"加载 {filename} 失败: {e}")
-    
-    return default_data
+# 存储引擎：json（默认，数据文件+预写日志）或 sqlite
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'data.db')
 
-def save_json_data(filename, data):
-    """安全保存JSON数据"""
-    try:
-        with data_lock:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as e:
-        print(f"保存 {filename} 失败: {e}")
-        return False
+# 修改先写入预写日志，再按时间间隔（秒）或日志条数阈值压缩进数据文件
+FLUSH_INTERVAL = float(os.environ.get('STORE_FLUSH_INTERVAL', '30'))
+FLUSH_THRESHOLD = int(os.environ.get('STORE_FLUSH_THRESHOLD', '1000'))
+# 是否在返回响应前fsync日志（关闭后崩溃可能丢失最近一批修改）
+JOURNAL_FSYNC = os.environ.get('STORE_JOURNAL_FSYNC', '1') != '0'
+# 在多个WSGI工作进程下运行时开启，进程间通过文件锁协调写入并同步缓存
+MULTIPROCESS = os.environ.get('STORE_MULTIPROCESS', '0') == '1'
+# 快照文件组提交窗口（秒），窗口内的多次保存合并为一次原子提交
+group_writer.window = float(os.environ.get('STORE_COMMIT_WINDOW', '0.005'))
+# 快照编码：json（缩进）、compact、orjson、fast（已安装orjson时用orjson，否则compact）、
+# binary（二进制快照，需要查看时用 python storage.py export 导出为JSON）
+STORE_CODEC = get_codec(os.environ.get('STORE_CODEC', 'fast'))
 
 # 初始化数据文件
-if not os.path.exists(DATA_FILE):
-    initial_data = {
-        "donations": [],
-        "members": [],
-        "applications": [],
-        "events": [],
-        "userPresence": {}
-    }
-    save_json_data(DATA_FILE, initial_data)
-
-if not os.path.exists(USERS_FILE):
-    initial_users = {
-        "users": [
-            {
-                "username": "admin",
-                "password": "admin123",
-                "role": "admin",
-                "created_at": datetime.now().isoformat()
-            }
-        ]
-    }
-    save_json_data(USERS_FILE, initial_users)
+initial_data = {
+    "donations": [],
+    "members": [],
+    "applications": [],
+    "events": [],
+    "userPresence": {}
+}
+
+initial_users = {
+    "users": [
+        {
+            "username": "admin",
+            "password": "admin123",
+            "role": "admin",
+            "created_at": datetime.now().isoformat()
+        }
+    ]
+}
+
+# 变更推送：保留的最近变更条数，以及SSE连接空闲时发送心跳的间隔（秒）
+CHANGE_FEED_HISTORY = int(os.environ.get('CHANGE_FEED_HISTORY', '1000'))
+CHANGE_FEED_KEEPALIVE = float(os.environ.get('CHANGE_FEED_KEEPALIVE', '15'))
+# 密码哈希：进程池大小、最多排队的任务数（超出返回503）、PBKDF2迭代次数
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', '2'))
+PASSWORD_QUEUE = int(os.environ.get('PASSWORD_QUEUE', '32'))
+PASSWORD_ITERATIONS = int(os.environ.get('PASSWORD_ITERATIONS', '200000'))
+# 限流：每分钟允许的次数（同时也是突发上限），以及每个限流器最多保留的键数
+RATE_LIMIT_LOGIN_IP = float(os.environ.get('RATE_LIMIT_LOGIN_IP', '20'))
+RATE_LIMIT_LOGIN_ACCOUNT = float(os.environ.get('RATE_LIMIT_LOGIN_ACCOUNT', '5'))
+RATE_LIMIT_REGISTER_IP = float(os.environ.get('RATE_LIMIT_REGISTER_IP', '5'))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+# 幂等键：响应保存的秒数、最多保存的键数、重复请求等待首个请求完成的秒数
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '10'))
+# 多进程部署时幂等键保存在该文件中，各进程共享
+IDEMPOTENCY_FILE = os.environ.get('IDEMPOTENCY_FILE', 'idempotency.json')
+# 管理员会话有效期（秒），以及验证时更新的最后活跃时间写回存储的间隔（秒）
+ADMIN_SESSION_TTL = float(os.environ.get('ADMIN_SESSION_TTL', '7200'))
+ADMIN_SESSION_CHECKPOINT = float(os.environ.get('ADMIN_SESSION_CHECKPOINT', '60'))
+# 没有连接的用户超过该时间（秒）不活跃即从在线状态中移除
+PRESENCE_TIMEOUT = float(os.environ.get('PRESENCE_TIMEOUT', '1800'))
+# 多进程部署时各进程的在线状态经该文件共享，每隔 PRESENCE_SYNC_INTERVAL 秒同步一次
+PRESENCE_FILE = os.environ.get('PRESENCE_FILE', 'presence.json')
+PRESENCE_SYNC_INTERVAL = float(os.environ.get('PRESENCE_SYNC_INTERVAL', '5'))
+
+# 二级索引：集合 -> 字段，find、按字段 update 和分页查询自动使用
+DATA_INDEXES = {
+    'donations': ['user_id'],
+    'wallet_transactions': ['user_id'],
+    'applications': ['status', 'id'],
+    'members': ['id', 'username', 'email'],
+}
+# 登录、改密码按会员ID和用户名查找用户
+USERS_INDEXES = {'users': ['id', 'username']}
+# 每个用户的捐款笔数和总额随写入增量维护
+DATA_TOTALS = {'donations': ('user_id', 'amount')}
+# 列表接口不返回的字段（申请中填写的密码）
+HIDDEN_FIELDS = {'applications': ('password', 'confirmPassword')}
+# 响应压缩：小于该字节数的响应不压缩；压缩级别（gzip 1-9，brotli 0-11）
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', '6'))
+# 记录数达到该值的集合响应改为逐段编码、流式发送
+STREAM_MIN_ITEMS = int(os.environ.get('STREAM_MIN_ITEMS', '1000'))
+# 列表接口分页时每页条数的默认值和上限
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '50'))
+LIST_PAGE_MAX = int(os.environ.get('LIST_PAGE_MAX', '500'))
+# 批量导入接口单次最多接受的行数
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', '10000'))
+
+# 密码在进程池中哈希和校验，不阻塞请求线程所在进程的CPU；
+# 子进程在存储、会话等后台线程启动之前创建
+password_hasher = PasswordHasher(PASSWORD_WORKERS, PASSWORD_QUEUE, PASSWORD_ITERATIONS).start()
+
+if STORAGE_BACKEND == 'sqlite':
+    # SQLite存储，首次启动时从现有的JSON文件导入
+    data_collections = [name for name in SQLITE_TABLES if name != 'users']
+    data_store = SqliteStore(SQLITE_FILE, data_collections, initial_data, DATA_FILE,
+                             extras=True, journal_fsync=JOURNAL_FSYNC, totals=DATA_TOTALS,
+                             indexes=DATA_INDEXES, import_shard_dir=DATA_SHARD_DIR).start()
+    users_store = SqliteStore(SQLITE_FILE, ['users'], initial_users, USERS_FILE,
+                              journal_fsync=JOURNAL_FSYNC, indexes=USERS_INDEXES).start()
+else:
+    # 常驻内存的数据存储，启动时加载一次
+    data_store = JsonStore(DATA_FILE, initial_data, FLUSH_INTERVAL, FLUSH_THRESHOLD, JOURNAL_FSYNC,
+                           shard_dir=DATA_SHARD_DIR, shared=MULTIPROCESS, codec=STORE_CODEC,
+                           indexes=DATA_INDEXES, totals=DATA_TOTALS).start()
+    users_store = JsonStore(USERS_FILE, initial_users, FLUSH_INTERVAL, FLUSH_THRESHOLD, JOURNAL_FSYNC,
+                            shared=MULTIPROCESS, codec=STORE_CODEC, indexes=USERS_INDEXES).start()
+
+# 数据修改后通过 /api/changes 推送给浏览器；管理员会话不对外推送。
+# 多进程部署时版本令牌和ETag取自共享存储的修改序号，在任一工作进程都有效；
+# 在线状态不经数据存储，不占用序号
+change_feed = ChangeFeed(CHANGE_FEED_HISTORY, exclude={'adminSessions'},
+                         source=data_store if MULTIPROCESS else None, local={'userPresence'})
+data_store.listeners.append(change_feed.publish)
+
+# 在线状态常驻内存，不写数据文件；上线、下线经变更源推送给管理后台。
+# 多进程部署时各进程的连接经共享存储合并，任一进程都能看到全部在线用户
+if MULTIPROCESS:
+    presence_store = JsonStore(PRESENCE_FILE, {}, FLUSH_INTERVAL, FLUSH_THRESHOLD, JOURNAL_FSYNC,
+                               shared=True, codec=STORE_CODEC).start()
+    presence = PresenceRegistry(timeout=PRESENCE_TIMEOUT, store=presence_store,
+                                sync_interval=PRESENCE_SYNC_INTERVAL)
+else:
+    presence = PresenceRegistry(timeout=PRESENCE_TIMEOUT)
+presence.listeners.append(change_feed.publish)
+presence.start()
+
+
+def check_password(user, password):
+    """校验用户密码；旧的明文密码或迭代次数不足的哈希在校验通过后升级"""
+    ok, rehash = password_hasher.verify(password, user.get('password'))
+    if rehash:
+        field = 'id' if user.get('id') is not None else 'username'
+        new_hash = password_hasher.hash(password)
+        with users_store.transaction('users'):
+            # 校验后密码被修改过时不再覆盖
+            matches = users_store.find('users', field, user[field])
+            if matches and matches[0].get('password') == user.get('password'):
+                users_store.update('users', user[field], {'password': new_hash}, field=field)
+    return ok
+
+# 管理员会话常驻内存，验证不写盘，按 expiresAt 到期删除
+admin_sessions = SessionStore(data_store, 'adminSessions', ADMIN_SESSION_TTL, ADMIN_SESSION_CHECKPOINT,
+                              shared=MULTIPROCESS).start()
+
+# 登录和自动注册按IP和账号限流，超限的请求在读取存储前返回429
+rate_limiters = {
+    name: TokenBucketLimiter(per_minute / 60, per_minute, RATE_LIMIT_MAX_KEYS)
+    for name, per_minute in (('login_ip', RATE_LIMIT_LOGIN_IP),
+                             ('login_account', RATE_LIMIT_LOGIN_ACCOUNT),
+                             ('register_ip', RATE_LIMIT_REGISTER_IP))
+}
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+def login_account():
+    """请求中的登录账号（会员ID或用户名），没有时不按账号限流"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None
+    account = data.get('memberId') or data.get('username')
+    return f"{request.path}:{account}" if account else None
+
+def rate_limited(*rules):
+    """按 (限流器名, 取键函数) 依次限流，任一超限即返回429"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            for name, key_fn in rules:
+                key = key_fn()
+                if key is None:
+                    continue
+                allowed, wait = rate_limiters[name].acquire(key)
+                if not allowed:
+                    return jsonify({"success": False, "message": "请求过于频繁，请稍后重试"}), 429, \
+                        {'Retry-After': str(max(1, math.ceil(wait)))}
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# 捐款和钱包充值、提款按 Idempotency-Key 缓存响应，客户端超时重试不会重复记账；
+# 多进程部署时保存在共享存储中，重试落到其他进程也能取得原结果
+if MULTIPROCESS:
+    idempotency_store = JsonStore(IDEMPOTENCY_FILE, {}, FLUSH_INTERVAL, FLUSH_THRESHOLD, JOURNAL_FSYNC,
+                                  shared=True, codec=STORE_CODEC).start()
+    idempotency_cache = SharedIdempotencyCache(idempotency_store, ttl=IDEMPOTENCY_TTL,
+                                               max_keys=IDEMPOTENCY_MAX_KEYS, wait=IDEMPOTENCY_WAIT)
+else:
+    idempotency_cache = IdempotencyCache(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_WAIT)
+
+def idempotent(view):
+    """带 Idempotency-Key 请求头的请求只执行一次
+
+    同一接口、同一个键的重复请求直接返回第一次的响应（带 Idempotent-Replayed 头），不读写存储；
+    请求体不同返回422，第一次请求仍在处理返回409。5xx响应和异常不缓存，可以用同一个键重试。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"success": False, "message": "Idempotency-Key 过长"}), 400
+        key = f"{request.path}:{key}"
+        try:
+            cached = idempotency_cache.claim(key, hashlib.sha256(request.get_data()).hexdigest())
+        except IdempotencyConflict as e:
+            return jsonify({"success": False, "message": str(e)}), 422
+        except IdempotencyBusy as e:
+            return jsonify({"success": False, "message": str(e)}), 409, {'Retry-After': '1'}
+        if cached is not None:
+            body, status = cached
+            return Response(body, status, mimetype='application/json', headers={'Idempotent-Replayed': 'true'})
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency_cache.release(key)
+            raise
+        if response.status_code >= 500:
+            idempotency_cache.release(key)
+        else:
+            idempotency_cache.complete(key, (response.get_data(), response.status_code))
+        return response
+    return wrapper
+
+def sse_message(event, token, payload):
+    """格式化一条SSE消息"""
+    return f"id: {token}\nevent: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def conditional(*collections):
+    """为GET接口加上ETag
+
+    ETag 由接口读取的集合的修改戳生成（不指定集合表示整个文档）；与 If-None-Match
+    匹配时直接返回304，不读取数据也不序列化。响应包含在线状态时再加上在线状态的版本，
+    心跳只改最后活跃时间、不经变更源，也要让ETag变化。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # 多进程模式下先同步其他进程的修改，否则ETag可能落后
+            data_store.refresh()
+            presence.refresh()
+            # 先取ETag再生成响应：期间发生的修改只会让下次请求重新获取
+            etag = change_feed.etag(collections)
+            if not collections or presence.collection in collections:
+                etag = f"{etag}-{presence.version}"
+            # 压缩后的响应带弱ETag，按弱比较匹配
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def hide_fields(collection, records):
+    """去掉集合中不对外返回的字段"""
+    hidden = HIDDEN_FIELDS.get(collection)
+    if not hidden:
+        return records
+    return [{k: v for k, v in record.items() if k not in hidden} if isinstance(record, dict) else record
+            for record in records]
+
+def list_page(collection):
+    """按查询参数分页读取列表集合
+
+    - limit：每页条数；cursor：上一页返回的 next_cursor
+    - sort：desc（默认，新的在前）或 asc，即按写入顺序
+    - fields：逗号分隔的返回字段
+    - 其余参数为字段相等条件，有索引的字段直接定位，其他字段逐条检查
+    只有不超过一个条件时才返回 total（符合条件的总数）。
+    """
+    args = request.args
+    limit = max(min(args.get('limit', LIST_PAGE_SIZE, type=int), LIST_PAGE_MAX), 0)
+    cursor = args.get('cursor', type=int)
+    sort = args.get('sort', 'desc')
+    if sort not in ('asc', 'desc'):
+        return jsonify({"success": False, "message": "sort 只能是 asc 或 desc"}), 400
+    fields = [f for f in args.get('fields', '').split(',') if f]
+    filters = {name: value for name, value in args.items() if name not in ('limit', 'cursor', 'sort', 'fields')}
+    total = data_store.count(collection, *next(iter(filters.items()), (None, None))) if len(filters) <= 1 else None
+
+    # 用第一个有索引的条件定位，其余条件在定位出的记录上检查
+    indexed = [name for name in filters if name in DATA_INDEXES.get(collection, ())]
+    field = indexed[0] if indexed else None
+    value = filters.pop(field) if field else None
+    # 多取一条判断是否还有下一页
+    if sort == 'asc':
+        # 第一页从最早的记录开始；两种存储的游标（位置、seq）都不小于0
+        after = cursor if cursor is not None else -1
+        page = data_store.page(collection, field, value, limit + 1, after=after, filters=filters)
+        page.reverse()
+    else:
+        page = data_store.page(collection, field, value, limit + 1, before=cursor, filters=filters)
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    records = hide_fields(collection, [record for _, record in page])
+    if fields:
+        records = [{f: record[f] for f in fields if f in record} for record in records]
+    return jsonify({
+        "success": True,
+        collection: records,
+        "count": len(records),
+        "total": total,
+        "next_cursor": page[-1][0] if has_more and page else None
+    })
+
+def _item_count(value, depth):
+    if not isinstance(value, (list, dict)):
+        return 0
+    if depth <= 1:
+        return len(value)
+    items = value.values() if isinstance(value, dict) else value
+    return sum(_item_count(item, depth - 1) for item in items)
+
+def json_response(value, depth=2):
+    """返回JSON；记录数较多时逐段编码流式发送，不在内存中拼出整个响应
+
+    depth 为展开的容器层数：集合列表为1，整个文档（集合 -> 记录）为2。
+    """
+    if _item_count(value, depth) < STREAM_MIN_ITEMS:
+        return jsonify(value)
+    return Response(iter_json(value, depth=depth), mimetype='application/json')
+
+# 压缩过的静态文件，按 (路径, ETag, 编码) 缓存
+_static_cache = OrderedDict()
+_static_cache_lock = threading.Lock()
+STATIC_CACHE_SIZE = 64
+
+@app.after_request
+def compress_response(response):
+    """按 Accept-Encoding 压缩响应
+
+    流式响应边生成边压缩；其余响应小于 COMPRESS_MIN_SIZE 时不压缩。
+    静态文件压缩结果按ETag缓存，文件不变时不重复压缩。
+    """
+    if response.status_code != 200 or 'Content-Encoding' in response.headers \
+            or not compressible(response.mimetype):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.direct_passthrough:
+        # 静态文件
+        etag, _ = response.get_etag()
+        key = (request.path, etag, encoding)
+        with _static_cache_lock:
+            data = _static_cache.get(key)
+            if data is not None:
+                _static_cache.move_to_end(key)
+        if data is not None:
+            if hasattr(response.response, 'close'):
+                response.call_on_close(response.response.close)
+        else:
+            response.direct_passthrough = False
+            raw = response.get_data()
+            if len(raw) < COMPRESS_MIN_SIZE:
+                return response
+            data = compress(raw, encoding, COMPRESS_LEVEL)
+            if etag:
+                # 压缩在锁外进行，只有读写缓存时持锁
+                with _static_cache_lock:
+                    _static_cache[key] = data
+                    if len(_static_cache) > STATIC_CACHE_SIZE:
+                        _static_cache.popitem(last=False)
+        response.direct_passthrough = False
+        response.set_data(data)
+    elif response.is_streamed:
+        response.response = compress_stream(response.response, encoding, COMPRESS_LEVEL)
+        response.headers.pop('Content-Length', None)
+    else:
+        raw = response.get_data()
+        if len(raw) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(raw, encoding, COMPRESS_LEVEL))
+
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后的字节与原文不同，强ETag降为弱ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
 # API路由
 
+@app.route('/api/changes', methods=['GET'])
+def stream_changes():
+    """数据变更推送（Server-Sent Events）
+
+    每批修改推送一条 change 事件，列出变化的集合；断线重连时浏览器带上
+    Last-Event-ID，错过的变更补发，已不在历史中时推送 reset 要求整体同步。
+    """
+    token = request.headers.get('Last-Event-ID') or request.args.get('since') or change_feed.token()
+
+    def stream(token):
+        yield 'retry: 3000\n\n'
+        while True:
+            events = change_feed.wait(token, CHANGE_FEED_KEEPALIVE)
+            if events is None:
+                token = change_feed.token()
+                yield sse_message('reset', token, {"version": token})
+            elif not events:
+                # 空闲时顺便同步其他工作进程的修改，有变化会在下一轮推送
+                data_store.refresh()
+                presence.refresh()
+                yield ': keepalive\n\n'
+            else:
+                token = change_feed.token(events[-1]['v'])
+                collections = {event['collection'] for event in events}
+                if None in collections:
+                    yield sse_message('reset', token, {"version": token})
+                else:
+                    yield sse_message('change', token, {"version": token, "collections": sorted(collections)})
+
+    return Response(stream(token), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/data', methods=['GET'])
+@conditional()
 def get_all_data():
-    """获取所有数据"""
-    data = load_json_data(DATA_FILE)
-    return jsonify(data)
+    """获取所有数据；带 since=<版本> 时只返回该版本之后的增量
+
+    全量响应的 X-Data-Version 头是取数前的数据版本，可作为 POST 的 If-Match。
+    """
+    if 'since' not in request.args:
+        version = change_feed.token()
+        data = data_store.snapshot()
+        data['userPresence'] = presence.snapshot()
+        response = json_response(data)
+        response.headers['X-Data-Version'] = version
+        return response
+
+    version, changes = change_feed.changes(request.args['since'])
+    if changes is None:
+        # 版本未知、历史已不完整或期间整体替换过：返回全量
+        data = data_store.snapshot()
+        data['userPresence'] = presence.snapshot()
+        return json_response({"version": version, "full": True, "data": data}, depth=3)
+    for name, change in changes.items():
+        if change is None:
+            changes[name] = {"replace": data_store.all(name)}
+    return jsonify({"version": version, "full": False, "changes": changes})
+
+# POST /api/data 支持的补丁格式
+PATCH_MODES = {
+    'application/json-patch+json': 'json-patch',
+    'application/merge-patch+json': 'merge',
+}
+_missing = object()
+
+def check_records(document, before=None):
+    """建了索引或累计值的集合必须是对象列表，否则抛出 ValueError
+
+    传入 before 时只检查与原值不是同一个对象的集合。
+    """
+    for name in set(DATA_INDEXES) | set(DATA_TOTALS):
+        records = document.get(name, _missing)
+        if records is _missing or (before is not None and records is before.get(name)):
+            continue
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError(f"{name} 应为对象列表")
+
+def write_patched(before, after):
+    """把补丁结果与原值逐个集合比较，只写入变化的部分
+
+    补丁只复制修改路径上的容器，未变化的集合和记录与原值是同一个对象，按身份比较即可。
+    列表集合原有记录位置不变且 id 不变时逐条替换、追加，否则整体替换该集合。
+    """
+    for name, new in after.items():
+        old = before.get(name)
+        if new is old:
+            continue
+        if isinstance(old, list) and isinstance(new, list) and len(new) >= len(old):
+            changed = [i for i in range(len(old)) if new[i] is not old[i]]
+            records = [new[i] for i in changed] + new[len(old):]
+            if all(isinstance(r, dict) for r in records) and \
+                    all(isinstance(old[i], dict) and old[i].get('id') == new[i].get('id') for i in changed):
+                for i in changed:
+                    data_store.set(name, new[i], index=i)
+                for record in new[len(old):]:
+                    data_store.insert(name, record)
+                continue
+        elif isinstance(old, dict) and isinstance(new, dict):
+            for key, value in new.items():
+                if key not in old or old[key] is not value:
+                    data_store.put(name, key, value)
+            for key in old.keys() - new.keys():
+                data_store.delete(name, key)
+            continue
+        data_store.set(name, new)
 
 @app.route('/api/data', methods=['POST'])
 def update_all_data():
-    """更新所有数据"""
+    """更新数据
+
+    按 Content-Type 区分：
+    - application/json-patch+json：RFC 6902 JSON Patch，test 不成立时返回409
+    - application/merge-patch+json：RFC 7396 JSON Merge Patch
+    - application/json：整体替换文档
+    带 If-Match: <数据版本> 时作为前置条件，该版本之后补丁涉及的集合被修改过则返回412。
+    数据版本见 GET /api/data 的 X-Data-Version 响应头和增量同步返回的 version。
+    """
     try:
-        new_data = request.get_json()
-        if save_json_data(DATA_FILE, new_data):
-            return jsonify({"success": True, "message": "数据更新成功"})
+        body = request.get_json()
+        mode = PATCH_MODES.get(request.mimetype)
+        if mode is not None:
+            names = touched_collections(body, merge=mode == 'merge')
+        elif isinstance(body, dict):
+            names = None
         else:
-            return jsonify({"success": False, "message": "数据保存失败"}), 500
+            return jsonify({"success": False, "message": "数据格式不正确"}), 400
+        expected = (request.headers.get('If-Match') or '').strip()
+        if expected.startswith('W/'):
+            expected = expected[2:]
+        expected = expected.strip('"')
+
+        # 不涉及的集合不加锁也不读取
+        with data_store.transaction(*(names or ())):
+            if expected and expected != '*':
+                events = change_feed.since(expected)
+                if events is None or any(event['collection'] is None or names is None
+                                         or event['collection'] in names for event in events):
+                    return jsonify({"success": False, "message": "数据已被其他人修改，请刷新后重试",
+                                    "version": change_feed.token()}), 412
+
+            if mode is None:
+                check_records(body)
+                data_store.replace(body)
+            else:
+                if names is None:
+                    before = data_store.snapshot()
+                else:
+                    before = {}
+                    for name in names:
+                        value = data_store.all(name, _missing)
+                        if value is not _missing:
+                            before[name] = value
+                if mode == 'merge':
+                    after = apply_merge_patch(before, body)
+                else:
+                    after = apply_json_patch(before, body)
+                if not isinstance(after, dict):
+                    return jsonify({"success": False, "message": "数据格式不正确"}), 400
+                check_records(after, before)
+                if before.keys() - after.keys():
+                    data_store.replace(after)
+                else:
+                    write_patched(before, after)
+
+        version = change_feed.token()
+        response = jsonify({"success": True, "message": "数据更新成功", "version": version})
+        response.headers['X-Data-Version'] = version
+        return response
+    except PatchConflict as e:
+        return jsonify({"success": False, "message": str(e)}), 409
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
+def read_bulk_rows():
+    """读取批量请求体，返回 [(行号, 记录, 错误信息)]，行号从1开始
+
+    Content-Type 为 application/x-ndjson 时逐行读取请求流，单行解析失败只影响该行；
+    否则请求体应为JSON数组。超过 BULK_MAX_ROWS 行时抛出 ValueError。
+    """
+    rows = []
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        for number, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append((number, json.loads(line), None))
+            except ValueError as e:
+                rows.append((number, None, f"JSON格式错误: {e}"))
+            if len(rows) > BULK_MAX_ROWS:
+                break
+    else:
+        records = request.get_json()
+        if not isinstance(records, list):
+            raise ValueError("请求体应为JSON数组或NDJSON")
+        rows = [(number, record, None) for number, record in enumerate(records, 1)]
+    if len(rows) > BULK_MAX_ROWS:
+        raise ValueError(f"单次最多导入 {BULK_MAX_ROWS} 行")
+    return rows
+
+_id_lock = threading.Lock()
+_last_id = 0
+
+def next_member_id(store, collection):
+    """分配会员（用户）ID：毫秒时间戳，本进程内单调递增，在 collection 中已存在时顺延
+
+    批量导入一次占用许多连续的ID，之后单个添加的会员从其后继续分配，不会重复。
+    只查当前事务所在的存储，不在持有一个存储的写锁时去等另一个存储的锁。
+    """
+    global _last_id
+    while True:
+        with _id_lock:
+            _last_id = max(int(time.time() * 1000), _last_id + 1)
+            candidate = str(_last_id)
+        if not store.find(collection, 'id', candidate):
+            return candidate
+
+def check_bulk_row(record):
+    """校验一行会员资料，返回错误信息，通过时返回 None"""
+    if not isinstance(record, dict):
+        return "每行应为JSON对象"
+    if record.get('email') and not validate_email(record['email']):
+        return "邮箱格式不正确"
+    if record.get('phone') and not validate_phone(record['phone']):
+        return "手机号格式不正确"
+    return None
+
+def allocate_username(wanted, taken, exists):
+    """返回不在 taken 中且 exists(用户名) 为假的用户名，并记入 taken；
+    wanted 为空或已被占用时生成新的用户名"""
+    username = wanted
+    for _ in range(100):
+        if username and username not in taken and not exists(username):
+            taken.add(username)
+            return username
+        username = generate_auto_username()
+    raise ValueError("无法分配唯一的用户名")
+
+def bulk_admin_check():
+    """批量接口需要管理员会话（X-Admin-Token 请求头），无效时返回错误响应"""
+    if admin_sessions.get(request.headers.get('X-Admin-Token')) is None:
+        return jsonify({"success": False, "message": "管理员会话无效或已过期"}), 401
+    return None
+
+def bulk_response(results):
+    created = sum(1 for result in results if result['success'])
+    return jsonify({
+        "success": True,
+        "results": results,
+        "created": created,
+        "failed": len(results) - created
+    })
+
 @app.route('/api/auto-register', methods=['POST'])
+@rate_limited(('register_ip', client_ip))
 def auto_register():
     """自动注册会员"""
     try:
@@ -116,156 +711,246 @@ def auto_register():
         if phone and not validate_phone(phone):
             return jsonify({"success": False, "message": "手机号格式不正确"}), 400
         
-        # 检查用户名是否已存在
-        users_data = load_json_data(USERS_FILE)
-        existing_users = users_data.get('users', [])
+        # 只保存密码哈希，在事务外计算
+        password_hash = password_hasher.hash(password)
         
-        for user in existing_users:
-            if user.get('username') == username:
+        with users_store.transaction('users'):
+            # 检查用户名是否已存在
+            if users_store.find('users', 'username', username):
                 # 如果用户名冲突，生成新的用户名
                 username = generate_auto_username()
-                break
+            
+            # 创建新用户
+            new_user = {
+                "id": next_member_id(users_store, 'users'),
+                "username": username,
+                "password": password_hash,
+                "email": email,
+                "phone": phone,
+                "realName": registration_data.get('realName', ''),
+                "city": registration_data.get('city', ''),
+                "interests": registration_data.get('interests', ''),
+                "role": "member",
+                "status": "active",  # 自动注册的用户直接激活
+                "auto_registered": True,
+                "created_at": datetime.now().isoformat()
+            }
+            
+            # 添加到用户列表
+            users_store.insert('users', new_user)
         
-        # 创建新用户
-        new_user = {
-            "id": str(int(time.time() * 1000)),
+        # 同时添加到会员列表
+        member_info = {
+            "id": new_user['id'],
             "username": username,
-            "password": password,
             "email": email,
+            "realName": new_user['realName'],
             "phone": phone,
-            "realName": registration_data.get('realName', ''),
-            "city": registration_data.get('city', ''),
-            "interests": registration_data.get('interests', ''),
-            "role": "member",
-            "status": "active",  # 自动注册的用户直接激活
-            "auto_registered": True,
-            "created_at": datetime.now().isoformat()
+            "city": new_user['city'],
+            "interests": new_user['interests'],
+            "joined_at": new_user['created_at'],
+            "status": "active",
+            "auto_registered": True
         }
+        data_store.insert('members', member_info)
         
-        # 添加到用户列表
-        if 'users' not in users_data:
-            users_data['users'] = []
-        users_data['users'].append(new_user)
-        
-        # 保存到文件
-        if save_json_data(USERS_FILE, users_data):
-            # 同时添加到会员列表
-            data = load_json_data(DATA_FILE)
-            if 'members' not in data:
-                data['members'] = []
-            
-            member_info = {
-                "id": new_user['id'],
+        # 记录注册统计
+        print(f"自动注册用户成功: {username} ({email})")
+        
+        return jsonify({
+            "success": True, 
+            "message": "自动注册成功",
+            "user": {
                 "username": username,
+                "password": password,
                 "email": email,
-                "realName": new_user['realName'],
-                "phone": phone,
-                "city": new_user['city'],
-                "interests": new_user['interests'],
-                "joined_at": new_user['created_at'],
-                "status": "active",
-                "auto_registered": True
+                "id": new_user['id']
+            },
+            "login_info": {
+                "username": username,
+                "password": password
             }
-            data['members'].append(member_info)
-            save_json_data(DATA_FILE, data)
-            
-            # 记录注册统计
-            print(f"自动注册用户成功: {username} ({email})")
+        })
             
-            return jsonify({
-                "success": True, 
-                "message": "自动注册成功",
-                "user": {
-                    "username": username,
-                    "password": password,
-                    "email": email,
-                    "id": new_user['id']
-                },
-                "login_info": {
+    except HasherBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503, {'Retry-After': '1'}
+    except Exception as e:
+        print(f"自动注册失败: {e}")
+        return jsonify({"success": False, "message": f"注册失败: {str(e)}"}), 400
+
+@app.route('/api/auto-register/bulk', methods=['POST'])
+def auto_register_bulk():
+    """批量注册会员（见 read_bulk_rows），返回每行的结果
+
+    所有用户在一个 users 事务内写入，会员在一个 members 事务内写入，
+    每个存储只落盘一次。未提供密码的行随机生成密码并在结果中返回。
+    """
+    error = bulk_admin_check()
+    if error:
+        return error
+    try:
+        rows = read_bulk_rows()
+        results = [None] * len(rows)
+        valid = []
+        for i, (number, record, message) in enumerate(rows):
+            message = message or check_bulk_row(record)
+            if message:
+                results[i] = {"row": number, "success": False, "message": message}
+            else:
+                valid.append(i)
+
+        # 密码在事务外分块哈希，不长时间占用进程池
+        passwords = {i: rows[i][1].get('password') or generate_auto_password() for i in valid}
+        hashes = dict(zip(valid, password_hasher.hash_many([passwords[i] for i in valid])))
+
+        now = datetime.now().isoformat()
+        taken = set()
+        new_users = []
+        with users_store.transaction('users'):
+            for i in valid:
+                number, record, _ = rows[i]
+                user_id = next_member_id(users_store, 'users')
+                username = allocate_username(record.get('username'), taken,
+                                             lambda name: users_store.find('users', 'username', name))
+                new_user = {
+                    "id": user_id,
                     "username": username,
-                    "password": password
+                    "password": hashes[i],
+                    "email": record.get('email') or f"auto_{user_id}@jlp.temp",
+                    "phone": record.get('phone', ''),
+                    "realName": record.get('realName', ''),
+                    "city": record.get('city', ''),
+                    "interests": record.get('interests', ''),
+                    "role": "member",
+                    "status": "active",
+                    "auto_registered": True,
+                    "created_at": now
                 }
-            })
-        else:
-            return jsonify({"success": False, "message": "用户数据保存失败"}), 500
-            
+                users_store.insert('users', new_user)
+                new_users.append((i, new_user))
+
+        with data_store.transaction('members'):
+            for i, new_user in new_users:
+                data_store.insert('members', {
+                    "id": new_user['id'],
+                    "username": new_user['username'],
+                    "email": new_user['email'],
+                    "realName": new_user['realName'],
+                    "phone": new_user['phone'],
+                    "city": new_user['city'],
+                    "interests": new_user['interests'],
+                    "joined_at": now,
+                    "status": "active",
+                    "auto_registered": True
+                })
+                result = {"row": rows[i][0], "success": True, "id": new_user['id'], "username": new_user['username']}
+                if not rows[i][1].get('password'):
+                    result['password'] = passwords[i]
+                results[i] = result
+
+        print(f"批量注册用户: 成功 {len(new_users)} 个，失败 {len(rows) - len(new_users)} 个")
+        return bulk_response(results)
+    except HasherBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
-        print(f"自动注册失败: {e}")
+        print(f"批量注册失败: {e}")
         return jsonify({"success": False, "message": f"注册失败: {str(e)}"}), 400
 
 @app.route('/api/donations', methods=['GET'])
+@conditional('donations')
 def get_donations():
-    """获取捐款记录"""
-    data = load_json_data(DATA_FILE)
-    return jsonify(data.get('donations', []))
+    """获取捐款记录；带查询参数时分页、过滤和选择字段（见 list_page）"""
+    if request.args:
+        return list_page('donations')
+    return json_response(data_store.all('donations', []), depth=1)
 
 @app.route('/api/donations', methods=['POST'])
+@idempotent
 def add_donation():
     """添加捐款记录"""
     try:
         donation = request.get_json()
-        data = load_json_data(DATA_FILE)
-        
-        if 'donations' not in data:
-            data['donations'] = []
         
         donation['id'] = str(int(time.time() * 1000))
         donation['created_at'] = datetime.now().isoformat()
-        data['donations'].append(donation)
+        data_store.insert('donations', donation)
         
-        if save_json_data(DATA_FILE, data):
-            return jsonify({"success": True, "message": "捐款记录添加成功", "id": donation['id']})
-        else:
-            return jsonify({"success": False, "message": "数据保存失败"}), 500
+        return jsonify({"success": True, "message": "捐款记录添加成功", "id": donation['id']})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
 @app.route('/api/donations/user/<user_id>', methods=['GET'])
+@conditional('donations')
 def get_user_donations(user_id):
-    """获取指定用户的捐款记录"""
+    """获取指定用户的捐款记录；summary=1 时只返回笔数和总额"""
     try:
-        data = load_json_data(DATA_FILE)
-        donations = data.get('donations', [])
-        
-        # 筛选该用户的捐款记录
-        user_donations = [d for d in donations if str(d.get('user_id')) == str(user_id)]
+        # 捐款笔数和总额
+        count, total_amount = data_store.totals('donations', user_id)
+        if request.args.get('summary') == '1':
+            return jsonify({"success": True, "total_amount": total_amount, "count": count})
         
-        # 计算捐款总额
-        total_amount = sum(float(d.get('amount', 0)) for d in user_donations)
+        # 该用户的捐款记录
+        user_donations = data_store.find('donations', 'user_id', user_id)
         
         return jsonify({
             "success": True,
             "donations": user_donations,
             "total_amount": total_amount,
-            "count": len(user_donations)
+            "count": count
         })
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
 @app.route('/api/members', methods=['GET'])
+@conditional('members')
 def get_members():
-    """获取会员列表"""
-    data = load_json_data(DATA_FILE)
-    return jsonify(data.get('members', []))
+    """获取会员列表；带查询参数时分页、过滤和选择字段（见 list_page）"""
+    if request.args:
+        return list_page('members')
+    return json_response(data_store.all('members', []), depth=1)
 
 @app.route('/api/members', methods=['POST'])
 def add_member():
     """添加会员"""
     try:
         member = request.get_json()
-        data = load_json_data(DATA_FILE)
         
-        if 'members' not in data:
-            data['members'] = []
-        
-        member['id'] = str(int(time.time() * 1000))
+        member['id'] = next_member_id(data_store, 'members')
         member['joined_at'] = datetime.now().isoformat()
-        data['members'].append(member)
+        data_store.insert('members', member)
         
-        if save_json_data(DATA_FILE, data):
-            return jsonify({"success": True, "message": "会员添加成功", "id": member['id']})
-        else:
-            return jsonify({"success": False, "message": "数据保存失败"}), 500
+        return jsonify({"success": True, "message": "会员添加成功", "id": member['id']})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+@app.route('/api/members/bulk', methods=['POST'])
+def add_members_bulk():
+    """批量添加会员（见 read_bulk_rows），在一个事务内写入，返回每行的结果
+
+    未提供用户名或用户名已被其他会员使用时分配新的用户名。
+    """
+    error = bulk_admin_check()
+    if error:
+        return error
+    try:
+        rows = read_bulk_rows()
+        results = []
+        now = datetime.now().isoformat()
+        taken = set()
+        with data_store.transaction('members'):
+            for number, member, message in rows:
+                message = message or check_bulk_row(member)
+                if message:
+                    results.append({"row": number, "success": False, "message": message})
+                    continue
+                member = dict(member)
+                member['id'] = next_member_id(data_store, 'members')
+                member['username'] = allocate_username(member.get('username'), taken,
+                                                       lambda name: data_store.find('members', 'username', name))
+                member['joined_at'] = now
+                data_store.insert('members', member)
+                results.append({"row": number, "success": True, "id": member['id'], "username": member['username']})
+        return bulk_response(results)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
@@ -274,94 +959,65 @@ def update_member(member_id):
     """更新会员信息"""
     try:
         update_data = request.get_json()
-        data = load_json_data(DATA_FILE)
-        
-        if 'members' not in data:
-            return jsonify({"success": False, "message": "会员列表为空"}), 404
         
-        member_found = False
-        for i, member in enumerate(data['members']):
-            if member.get('id') == member_id:
-                data['members'][i].update(update_data)
-                member_found = True
-                break
-        
-        if not member_found:
+        # 按 id 索引定位会员
+        if data_store.update('members', member_id, update_data) is None:
             return jsonify({"success": False, "message": "会员不存在"}), 404
         
-        if save_json_data(DATA_FILE, data):
-            return jsonify({"success": True, "message": "会员信息更新成功"})
-        else:
-            return jsonify({"success": False, "message": "数据保存失败"}), 500
+        return jsonify({"success": True, "message": "会员信息更新成功"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
 @app.route('/api/applications', methods=['GET'])
+@conditional('applications')
 def get_applications():
-    """获取申请列表"""
-    data = load_json_data(DATA_FILE)
-    return jsonify(data.get('applications', []))
+    """获取申请列表；带查询参数时分页、过滤和选择字段（见 list_page）"""
+    if request.args:
+        return list_page('applications')
+    return json_response(hide_fields('applications', data_store.all('applications', [])), depth=1)
 
 @app.route('/api/applications', methods=['POST'])
 def add_application():
     """添加申请"""
     try:
         application = request.get_json()
-        data = load_json_data(DATA_FILE)
-        
-        if 'applications' not in data:
-            data['applications'] = []
         
         application['id'] = str(int(time.time() * 1000))
         application['created_at'] = datetime.now().isoformat()
-        data['applications'].append(application)
+        data_store.insert('applications', application)
         
-        if save_json_data(DATA_FILE, data):
-            return jsonify({"success": True, "message": "申请添加成功", "id": application['id']})
-        else:
-            return jsonify({"success": False, "message": "数据保存失败"}), 500
+        return jsonify({"success": True, "message": "申请添加成功", "id": application['id']})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
 @app.route('/api/applications/rejected', methods=['GET'])
+@conditional('applications')
 def get_rejected_applications():
     """获取被拒绝的申请列表"""
-    data = load_json_data(DATA_FILE)
-    applications = data.get('applications', [])
-    rejected_applications = [app for app in applications if app.get('status') == 'rejected']
-    return jsonify(rejected_applications)
+    return jsonify(hide_fields('applications', data_store.find('applications', 'status', 'rejected')))
 
 @app.route('/api/user-presence', methods=['GET'])
+@conditional('userPresence')
 def get_user_presence():
     """获取用户在线状态"""
-    data = load_json_data(DATA_FILE)
-    return jsonify(data.get('userPresence', {}))
+    return jsonify(presence.snapshot())
 
 @app.route('/api/user-presence', methods=['POST'])
 def update_user_presence():
-    """更新用户在线状态"""
+    """更新用户在线状态（不支持WebSocket时的心跳）"""
     try:
         presence_data = request.get_json()
-        data = load_json_data(DATA_FILE)
-        
-        if 'userPresence' not in data:
-            data['userPresence'] = {}
         
         username = presence_data.get('username')
         if username:
-            data['userPresence'][username] = {
-                'online': presence_data.get('online', False),
-                'lastActive': datetime.now().isoformat()
-            }
+            presence.touch(username, presence_data.get('online', False))
         
-        if save_json_data(DATA_FILE, data):
-            return jsonify({"success": True, "message": "在线状态更新成功"})
-        else:
-            return jsonify({"success": False, "message": "数据保存失败"}), 500
+        return jsonify({"success": True, "message": "在线状态更新成功"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
 @app.route('/api/login', methods=['POST'])
+@rate_limited(('login_ip', client_ip), ('login_account', login_account))
 def login():
     """用户登录 - 支持会员ID或用户名登录"""
     try:
@@ -376,35 +1032,26 @@ def login():
         if not password:
             return jsonify({"success": False, "message": "请输入密码"}), 400
         
-        users_data = load_json_data(USERS_FILE)
         found_user = None
         
         # 优先通过会员ID查找
         if member_id:
-            for user in users_data.get('users', []):
-                if user.get('id') == member_id and user.get('password') == password:
+            for user in users_store.find('users', 'id', member_id):
+                if check_password(user, password):
                     found_user = user
                     username = user.get('username')  # 获取用户名用于在线状态
                     break
         
         # 如果会员ID没找到，尝试用户名（向后兼容）
         if not found_user and username:
-            for user in users_data.get('users', []):
-                if user.get('username') == username and user.get('password') == password:
+            for user in users_store.find('users', 'username', username):
+                if check_password(user, password):
                     found_user = user
                     break
         
         if found_user:
             # 更新在线状态
-            data = load_json_data(DATA_FILE)
-            if 'userPresence' not in data:
-                data['userPresence'] = {}
-            
-            data['userPresence'][username] = {
-                'online': True,
-                'lastActive': datetime.now().isoformat()
-            }
-            save_json_data(DATA_FILE, data)
+            presence.touch(username)
             
             return jsonify({
                 "success": True, 
@@ -418,10 +1065,13 @@ def login():
             })
         
         return jsonify({"success": False, "message": "会员ID/用户名或密码错误"}), 401
+    except HasherBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
 @app.route('/api/admin/login', methods=['POST'])
+@rate_limited(('login_ip', client_ip), ('login_account', login_account))
 def admin_login():
     """管理员登录"""
     try:
@@ -429,34 +1079,14 @@ def admin_login():
         username = login_data.get('username')
         password = login_data.get('password')
         
-        users_data = load_json_data(USERS_FILE)
-        
-        for user in users_data.get('users', []):
-            if user.get('username') == username and user.get('password') == password and user.get('role') == 'admin':
-                # 生成管理员会话令牌
-                session_token = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
+        candidates = users_store.find('users', 'username', username) if username else []
+        for user in candidates:
+            if user.get('role') == 'admin' and check_password(user, password):
+                # 生成管理员会话令牌，ADMIN_SESSION_TTL 后过期
+                session_token, session = admin_sessions.create(username)
                 
                 # 更新在线状态
-                data = load_json_data(DATA_FILE)
-                if 'adminSessions' not in data:
-                    data['adminSessions'] = {}
-                
-                data['adminSessions'][session_token] = {
-                    'username': username,
-                    'loginTime': datetime.now().isoformat(),
-                    'lastActive': datetime.now().isoformat(),
-                    'expiresAt': (datetime.now().timestamp() + 7200) * 1000  # 2小时后过期
-                }
-                
-                if 'userPresence' not in data:
-                    data['userPresence'] = {}
-                
-                data['userPresence'][username] = {
-                    'online': True,
-                    'lastActive': datetime.now().isoformat()
-                }
-                
-                save_json_data(DATA_FILE, data)
+                presence.touch(username)
                 
                 return jsonify({
                     "success": True, 
@@ -467,10 +1097,12 @@ def admin_login():
                         "role": user.get('role', 'admin'),
                         "id": user.get('id', str(int(time.time() * 1000)))
                     },
-                    "expiresAt": data['adminSessions'][session_token]['expiresAt']
+                    "expiresAt": session['expiresAt']
                 })
         
         return jsonify({"success": False, "message": "管理员账号或密码错误"}), 401
+    except HasherBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
@@ -484,24 +1116,10 @@ def validate_admin_session():
         if not token:
             return jsonify({"success": False, "message": "未提供会话令牌"}), 401
         
-        data = load_json_data(DATA_FILE)
-        admin_sessions = data.get('adminSessions', {})
-        
-        if token not in admin_sessions:
-            return jsonify({"success": False, "message": "无效的会话令牌"}), 401
-        
-        session = admin_sessions[token]
-        current_time = datetime.now().timestamp() * 1000
-        
-        if current_time > session.get('expiresAt', 0):
-            # 会话已过期，删除会话
-            del admin_sessions[token]
-            save_json_data(DATA_FILE, data)
-            return jsonify({"success": False, "message": "会话已过期"}), 401
-        
-        # 更新最后活跃时间
-        session['lastActive'] = datetime.now().isoformat()
-        save_json_data(DATA_FILE, data)
+        # 查内存中的会话并更新最后活跃时间，不写盘；过期会话由到期队列删除
+        session = admin_sessions.touch(token)
+        if session is None:
+            return jsonify({"success": False, "message": "无效的会话令牌或会话已过期"}), 401
         
         return jsonify({
             "success": True, 
@@ -525,12 +1143,7 @@ def admin_logout():
         if not token:
             return jsonify({"success": False, "message": "未提供会话令牌"}), 400
         
-        data = load_json_data(DATA_FILE)
-        admin_sessions = data.get('adminSessions', {})
-        
-        if token in admin_sessions:
-            del admin_sessions[token]
-            save_json_data(DATA_FILE, data)
+        if admin_sessions.delete(token) is not None:
             return jsonify({"success": True, "message": "管理员已退出登录"})
         
         return jsonify({"success": False, "message": "会话不存在"}), 404
@@ -546,22 +1159,25 @@ def user_change_password():
         new_password = payload.get('newPassword')
         if not member_id or not current_password or not new_password:
             return jsonify({"success": False, "message": "缺少必要参数"}), 400
-        users_data = load_json_data(USERS_FILE)
-        users = users_data.get('users', [])
-        target = None
-        for u in users:
-            if u.get('id') == member_id:
-                target = u
-                break
+        matches = users_store.find('users', 'id', member_id)
+        target = matches[0] if matches else None
         if not target:
             return jsonify({"success": False, "message": "会员不存在"}), 404
-        if target.get('password') != current_password:
+        # 哈希计算较慢，在事务外完成，不长时间占用用户集合的写锁
+        if not password_hasher.verify(current_password, target.get('password'))[0]:
             return jsonify({"success": False, "message": "当前密码不正确"}), 401
-        target['password'] = new_password
-        target['updated_at'] = datetime.now().isoformat()
-        if save_json_data(USERS_FILE, users_data):
-            return jsonify({"success": True, "message": "密码修改成功"})
-        return jsonify({"success": False, "message": "保存数据失败"}), 500
+        new_hash = password_hasher.hash(new_password)
+        with users_store.transaction('users'):
+            matches = users_store.find('users', 'id', member_id)
+            if not matches or matches[0].get('password') != target.get('password'):
+                return jsonify({"success": False, "message": "密码已被修改，请重试"}), 409
+            users_store.update('users', target['id'], {
+                'password': new_hash,
+                'updated_at': datetime.now().isoformat()
+            })
+        return jsonify({"success": True, "message": "密码修改成功"})
+    except HasherBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
@@ -582,37 +1198,75 @@ def admin_change_password():
             return jsonify({"success": False, "message": "缺少必要参数"}), 400
         
         # 验证管理员会话
-        data = load_json_data(DATA_FILE)
-        admin_sessions = data.get('adminSessions', {})
-        
-        if token not in admin_sessions:
+        if admin_sessions.get(token) is None:
             return jsonify({"success": False, "message": "管理员会话无效或已过期"}), 401
         
-        # 加载用户数据
-        users_data = load_json_data(USERS_FILE)
-        users = users_data.get('users', [])
-        
-        # 查找会员
-        member_found = False
-        for user in users:
-            if user.get('id') == member_id:
-                member_found = True
-                user['password'] = new_password
-                user['updated_at'] = datetime.now().isoformat()
-                break
+        # 查找并更新会员，只保存哈希
+        updated = users_store.update('users', member_id, {
+            'password': password_hasher.hash(new_password),
+            'updated_at': datetime.now().isoformat()
+        })
         
-        if not member_found:
+        if updated is None:
             return jsonify({"success": False, "message": "会员不存在"}), 404
         
-        # 保存数据
-        if save_json_data(USERS_FILE, users_data):
-            return jsonify({"success": True, "message": "密码修改成功"})
-        else:
-            return jsonify({"success": False, "message": "保存数据失败"}), 500
+        return jsonify({"success": True, "message": "密码修改成功"})
             
+    except HasherBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """运行指标：各限流器放行和拒绝的次数，密码哈希因排队已满拒绝的次数，以及幂等键命中情况"""
+    return jsonify({
+        "rate_limits": {name: limiter.metrics() for name, limiter in rate_limiters.items()},
+        "password_hasher": {"rejected": password_hasher.rejected},
+        "idempotency": idempotency_cache.metrics()
+    })
+
+def presence_socket(ws):
+    """在线状态 WebSocket（/ws/presence）
+
+    连接后先发一条JSON消息：
+    - {"type": "join", "username": ...}：会员页面，连接期间在线，全部连接断开即离线
+    - {"type": "watch"}：管理后台，先收到 snapshot，之后每次上线、下线收到一条 presence
+    """
+    hello = json.loads(ws.receive() or '{}')
+    if hello.get('type') == 'join' and hello.get('username'):
+        username = str(hello['username'])
+        presence.connect(username)
+        try:
+            while True:
+                # 客户端的心跳消息无需处理，连接断开时抛出异常
+                ws.receive()
+        finally:
+            presence.disconnect(username)
+    elif hello.get('type') == 'watch':
+        token = change_feed.token()
+        ws.send(json.dumps({"type": "snapshot", "presence": presence.snapshot()}, ensure_ascii=False))
+        while ws.connected:
+            events = change_feed.wait(token, CHANGE_FEED_KEEPALIVE)
+            if events is None:
+                # 历史已不完整，重发全量
+                token = change_feed.token()
+                ws.send(json.dumps({"type": "snapshot", "presence": presence.snapshot()}, ensure_ascii=False))
+                continue
+            if not events:
+                # 空闲时同步其他工作进程的在线状态，有变化会在下一轮推送
+                presence.refresh()
+                ws.send(json.dumps({"type": "ping"}))
+                continue
+            token = change_feed.token(events[-1]['v'])
+            for event in events:
+                if event['collection'] == presence.collection:
+                    ws.send(json.dumps({"type": "presence", "username": event['key'],
+                                        "presence": event['value']}, ensure_ascii=False))
+
+if Sock is not None:
+    Sock(app).route('/ws/presence')(presence_socket)
+
 # 静态文件服务
 @app.route('/<path:path>')
 def serve_static(path):
@@ -624,32 +1278,6 @@ def serve_index():
     """提供首页"""
     return send_from_directory('.', 'index.html')
 
-# 定期清理离线用户
-def cleanup_offline_users():
-    """定期清理长时间不活跃的用户"""
-    while True:
-        try:
-            data = load_json_data(DATA_FILE)
-            if 'userPresence' in data:
-                current_time = datetime.now()
-                offline_users = []
-                
-                for username, presence in data['userPresence'].items():
-                    last_active = datetime.fromisoformat(presence.get('lastActive', ''))
-                    if (current_time - last_active).total_seconds() > 1800:  # 30分钟不活跃
-                        offline_users.append(username)
-                
-                for username in offline_users:
-                    del data['userPresence'][username]
-                
-                if offline_users:
-                    save_json_data(DATA_FILE, data)
-            
-            time.sleep(300)  # 每5分钟检查一次
-        except Exception as e:
-            print(f"清理离线用户失败: {e}")
-            time.sleep(300)
-
 def generate_auto_username():
     """生成自动用户名"""
     adjectives = ['快乐', '聪明', '友好', '活跃', '阳光', '热情', '可爱', '机智', '勇敢', '温柔']
@@ -683,20 +1311,17 @@ def validate_phone(phone):
 def get_user_wallet(user_id):
     """获取用户钱包信息"""
     try:
-        data = load_json_data(DATA_FILE)
-        if 'wallets' not in data:
-            data['wallets'] = {}
-        
-        if user_id not in data['wallets']:
-            # 创建新钱包
-            data['wallets'][user_id] = {
-                'balance': 0.00,
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat()
-            }
-            save_json_data(DATA_FILE, data)
+        with data_store.transaction('wallets'):
+            wallet = data_store.get('wallets', user_id)
+            if wallet is None:
+                # 创建新钱包
+                wallet = data_store.put('wallets', user_id, {
+                    'balance': 0.00,
+                    'created_at': datetime.now().isoformat(),
+                    'updated_at': datetime.now().isoformat()
+                })
         
-        return data['wallets'][user_id]
+        return wallet
     except Exception as e:
         print(f"获取钱包信息失败: {e}")
         return {'balance': 0.00, 'error': str(e)}
@@ -704,10 +1329,6 @@ def get_user_wallet(user_id):
 def create_wallet_transaction(user_id, type, amount, description="", status="completed"):
     """创建钱包交易记录"""
     try:
-        data = load_json_data(DATA_FILE)
-        if 'wallet_transactions' not in data:
-            data['wallet_transactions'] = []
-        
         transaction = {
             'id': str(int(time.time() * 1000)),
             'user_id': user_id,
@@ -715,58 +1336,46 @@ def create_wallet_transaction(user_id, type, amount, description="", status="com
             'amount': float(amount),
             'description': description,
             'status': status,  # completed, pending, failed
-            'created_at': datetime.now().isoformat()
         }
         
-        data['wallet_transactions'].append(transaction)
-        
-        # 更新钱包余额
-        if 'wallets' not in data:
-            data['wallets'] = {}
-        
-        if user_id not in data['wallets']:
-            data['wallets'][user_id] = {'balance': 0.00}
-        
-        if type == 'deposit':
-            data['wallets'][user_id]['balance'] += float(amount)
-        elif type == 'withdraw':
-            if data['wallets'][user_id]['balance'] >= float(amount):
-                data['wallets'][user_id]['balance'] -= float(amount)
-            else:
-                return {'success': False, 'message': '余额不足'}
-        
-        data['wallets'][user_id]['updated_at'] = datetime.now().isoformat()
+        with data_store.transaction('wallets', 'wallet_transactions'):
+            # 在锁内取时间，保证同一集合中的交易按时间顺序追加
+            transaction['created_at'] = datetime.now().isoformat()
+            
+            # 更新钱包余额
+            wallet = dict(data_store.get('wallets', user_id) or {'balance': 0.00})
+            
+            if type == 'deposit':
+                wallet['balance'] += float(amount)
+            elif type == 'withdraw':
+                if wallet['balance'] >= float(amount):
+                    wallet['balance'] -= float(amount)
+                else:
+                    return {'success': False, 'message': '余额不足'}
+            
+            wallet['updated_at'] = datetime.now().isoformat()
+            
+            data_store.insert('wallet_transactions', transaction)
+            data_store.put('wallets', user_id, wallet)
         
-        if save_json_data(DATA_FILE, data):
-            return {'success': True, 'transaction': transaction}
-        else:
-            return {'success': False, 'message': '保存交易记录失败'}
+        return {'success': True, 'transaction': transaction}
             
     except Exception as e:
         print(f"创建交易记录失败: {e}")
         return {'success': False, 'message': str(e)}
 
-def get_wallet_transactions(user_id, limit=50):
-    """获取用户钱包交易记录"""
+def get_wallet_transactions(user_id, limit=50, before=None, after=None):
+    """获取用户钱包交易记录，按时间倒序返回 [(游标, 交易)]；before/after 为上一次返回的游标"""
     try:
-        data = load_json_data(DATA_FILE)
-        if 'wallet_transactions' not in data:
-            return []
-        
-        # 过滤该用户的交易记录，按时间倒序排列
-        user_transactions = [
-            t for t in data['wallet_transactions'] 
-            if t['user_id'] == user_id
-        ]
-        user_transactions.sort(key=lambda x: x['created_at'], reverse=True)
-        
-        return user_transactions[:limit]
+        # 交易按时间顺序追加，直接从该用户的索引中取一页
+        return data_store.page('wallet_transactions', 'user_id', user_id, limit, before, after)
     except Exception as e:
         print(f"获取交易记录失败: {e}")
         return []
 
 # 钱包相关API端点
 @app.route('/api/wallet/<user_id>', methods=['GET'])
+@conditional('wallets')
 def get_wallet(user_id):
     """获取用户钱包信息"""
     try:
@@ -782,6 +1391,7 @@ def get_wallet(user_id):
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/api/wallet/deposit', methods=['POST'])
+@idempotent
 def wallet_deposit():
     """钱包充值"""
     try:
@@ -813,6 +1423,7 @@ def wallet_deposit():
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/api/wallet/withdraw', methods=['POST'])
+@idempotent
 def wallet_withdraw():
     """钱包提款"""
     try:
@@ -844,47 +1455,58 @@ def wallet_withdraw():
         return jsonify({"success": False, "message": str(e)}), 500
 
 @app.route('/api/wallet/transactions/<user_id>', methods=['GET'])
+@conditional('wallet_transactions')
 def get_wallet_transactions_api(user_id):
     """获取用户钱包交易记录"""
     try:
         limit = request.args.get('limit', 50, type=int)
-        transactions = get_wallet_transactions(user_id, limit)
+        before = request.args.get('before', type=int)
+        after = request.args.get('after', type=int)
+        page = get_wallet_transactions(user_id, limit, before, after)
+        transactions = [transaction for _, transaction in page]
         
         return jsonify({
             "success": True,
             "transactions": transactions,
-            "count": len(transactions)
+            "count": len(transactions),
+            # before 取更早的一页，after 取更新的一页
+            "cursors": {
+                "before": page[-1][0] if page else before,
+                "after": page[0][0] if page else after
+            }
         })
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
-# 启动清理线程
-cleanup_thread = threading.Thread(target=cleanup_offline_users, daemon=True)
-cleanup_thread.start()
-
 if __name__ == '__main__':
     print("启动极简后端API服务器...")
     print("服务器运行在: http://localhost:5050")
     print("API端点:")
     print("  GET  /api/data              - 获取所有数据")
+    print("  GET  /api/changes           - 数据变更推送（SSE）")
     print("  POST /api/data              - 更新所有数据")
     print("  GET  /api/donations         - 获取捐款记录")
-    print("  POST /api/donations         - 添加捐款记录")
+    print("  POST /api/donations         - 添加捐款记录（支持 Idempotency-Key）")
     print("  GET  /api/members           - 获取会员列表")
     print("  POST /api/members           - 添加会员")
+    print("  POST /api/members/bulk      - 批量添加会员（JSON数组或NDJSON）")
     print("  PUT  /api/members/<id>      - 更新会员信息")
     print("  GET  /api/applications      - 获取申请列表")
     print("  POST /api/applications      - 添加申请")
     print("  GET  /api/user-presence     - 获取用户在线状态")
     print("  POST /api/user-presence     - 更新用户在线状态")
+    if Sock is not None:
+        print("  WS   /ws/presence           - 在线状态连接与推送")
     print("  POST /api/login             - 用户登录")
     print("  POST /api/admin/login       - 管理员登录")
     print("  POST /api/admin/validate    - 验证管理员会话")
     print("  POST /api/admin/logout      - 管理员退出登录")
     print("  POST /api/auto-register     - 自动注册会员")
+    print("  POST /api/auto-register/bulk - 批量自动注册会员（JSON数组或NDJSON）")
+    print("  GET  /api/metrics           - 限流、幂等键等运行指标")
     print("  GET  /api/wallet/<user_id>  - 获取用户钱包信息")
-    print("  POST /api/wallet/deposit    - 钱包充值")
-    print("  POST /api/wallet/withdraw   - 钱包提款")
+    print("  POST /api/wallet/deposit    - 钱包充值（支持 Idempotency-Key）")
+    print("  POST /api/wallet/withdraw   - 钱包提款（支持 Idempotency-Key）")
     print("  GET  /api/wallet/transactions/<user_id> - 获取交易记录")
     print("")
     print("自动注册功能已启用！")
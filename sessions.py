@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+管理员会话 - 常驻内存，验证只查字典，最后活跃时间定期批量写回存储
+"""
+
+import atexit
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from expiry import ExpiryQueue
+
+
+class SessionStore:
+    """管理员会话表
+
+    会话创建和删除立即写入存储（重启后仍有效）；验证只更新内存中的 lastActive，
+    由后台线程每 checkpoint_interval 秒把变化过的会话一次性写回。
+    会话按 expiresAt 到期删除。内存中找不到的令牌会回查存储一次，
+    以便多进程部署时使用其他进程创建的会话；shared 为真（多进程部署）时内存中的会话
+    也要在存储中仍存在才有效，其他进程退出登录后立即失效。
+    """
+
+    def __init__(self, store, collection='adminSessions', ttl=7200, checkpoint_interval=60, shared=False):
+        self.store = store
+        self.shared = shared
+        self.collection = collection
+        self.ttl = ttl
+        self.checkpoint_interval = checkpoint_interval
+        self._lock = threading.Lock()
+        self._sessions = dict(store.all(collection) or {})
+        self._dirty = set()
+        self._expiry = ExpiryQueue(self._expire)
+        for token, session in self._sessions.items():
+            self._expiry.schedule(token, session.get('expiresAt', 0) / 1000)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动到期清理和定期写回线程"""
+        self._expiry.start()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._checkpoint_loop, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def create(self, username):
+        """创建会话，返回 (令牌, 会话)"""
+        token = secrets.token_urlsafe(24)
+        now = datetime.now()
+        session = {
+            'username': username,
+            'loginTime': now.isoformat(),
+            'lastActive': now.isoformat(),
+            'expiresAt': (now.timestamp() + self.ttl) * 1000,
+        }
+        self.store.put(self.collection, token, session)
+        with self._lock:
+            self._sessions[token] = session
+        self._expiry.schedule(token, session['expiresAt'] / 1000)
+        return token, session
+
+    def get(self, token):
+        """返回未过期的会话，不更新活跃时间"""
+        with self._lock:
+            session = self._sessions.get(token)
+        if session is None:
+            session = self._load(token)
+        elif self.shared and self.store.get(self.collection, token) is None:
+            # 已被其他进程删除
+            self._forget(token)
+            return None
+        if session is None or session.get('expiresAt', 0) <= time.time() * 1000:
+            return None
+        return session
+
+    def touch(self, token):
+        """验证会话并记录活跃时间，返回会话；无效或已过期时返回 None"""
+        session = self.get(token)
+        if session is None:
+            return None
+        with self._lock:
+            if token not in self._sessions:
+                return None
+            session = self._sessions[token] = {**session, 'lastActive': datetime.now().isoformat()}
+            self._dirty.add(token)
+        return session
+
+    def delete(self, token):
+        """删除会话，返回被删除的会话"""
+        with self._lock:
+            session = self._sessions.pop(token, None)
+            self._dirty.discard(token)
+        self._expiry.cancel(token)
+        stored = self.store.delete(self.collection, token)
+        return session or stored
+
+    def checkpoint(self):
+        """把变化过的活跃时间写回存储"""
+        with self._lock:
+            changed = {token: self._sessions[token] for token in self._dirty if token in self._sessions}
+            self._dirty.clear()
+        if not changed:
+            return 0
+        with self.store.transaction(self.collection):
+            for token, session in changed.items():
+                # 期间被其他进程删除的会话不再写回
+                if self.store.get(self.collection, token) is not None:
+                    self.store.put(self.collection, token, session)
+        return len(changed)
+
+    def _load(self, token):
+        session = self.store.get(self.collection, token)
+        if session is None:
+            return None
+        with self._lock:
+            session = self._sessions.setdefault(token, session)
+        self._expiry.schedule(token, session.get('expiresAt', 0) / 1000)
+        return session
+
+    def _forget(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+            self._dirty.discard(token)
+        self._expiry.cancel(token)
+
+    def _expire(self, token):
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is not None and session.get('expiresAt', 0) > time.time() * 1000:
+                return
+            self._sessions.pop(token, None)
+            self._dirty.discard(token)
+        self.store.delete(self.collection, token)
+
+    def _checkpoint_loop(self):
+        while not self._stopped.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f"写回管理员会话失败: {e}")
+
+    def close(self):
+        """停止后台线程并写回剩余的活跃时间"""
+        self._stopped.set()
+        self.checkpoint()
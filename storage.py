@@ -0,0 +1,1785 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据存储层 - 常驻内存的JSON文档存储
+启动时加载一次数据文件，读请求直接访问内存，修改追加到预写日志后由后台线程压缩进快照
+另提供接口相同的可选SQLite存储引擎
+"""
+
+import atexit
+import json
+import os
+import pickle
+import re
+import sqlite3
+import tempfile
+import threading
+import itertools
+import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import ExitStack, contextmanager, nullcontext
+from urllib.parse import quote, unquote
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支持多进程模式
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # 未安装时使用标准库json
+    orjson = None
+
+
+# 编码
+
+SNAPSHOT_MAGIC = b'XGSNAP1\n'
+# 快照文件可能使用的后缀，同一快照在不同编码下只保留最新的一个
+SNAPSHOT_SUFFIXES = ('.json', '.snap')
+
+
+class JsonCodec:
+    """标准库JSON；indent 为空时输出不带空白的紧凑格式"""
+    name = 'json'
+    suffix = '.json'
+
+    def __init__(self, indent=2):
+        self.indent = indent
+        self.separators = None if indent else (',', ':')
+
+    def dumps(self, data):
+        return json.dumps(data, ensure_ascii=False, indent=self.indent, separators=self.separators).encode('utf-8')
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson：输出与紧凑JSON相同，编码和解析都比标准库快数倍"""
+    name = 'orjson'
+
+    def __init__(self, indent=None):
+        super().__init__(indent)
+        self.option = orjson.OPT_INDENT_2 if indent else 0
+
+    def dumps(self, data):
+        try:
+            return orjson.dumps(data, option=self.option)
+        except TypeError:
+            # 超过64位的整数等orjson不支持的值
+            return super().dumps(data)
+
+
+class BinaryCodec:
+    """二进制快照（pickle），只用于服务器私有状态；需要人工查看时导出为JSON"""
+    name = 'binary'
+    suffix = '.snap'
+
+    def dumps(self, data):
+        return SNAPSHOT_MAGIC + pickle.dumps(data, protocol=4)
+
+
+def get_codec(name):
+    """按名称取编码：json（缩进）、compact、orjson、binary，fast 表示可用时用orjson否则用compact"""
+    if name == 'json':
+        return JsonCodec()
+    if name == 'compact' or (name == 'fast' and orjson is None):
+        return JsonCodec(indent=None)
+    if name in ('orjson', 'fast'):
+        if orjson is None:
+            raise ValueError("未安装 orjson")
+        return OrjsonCodec()
+    if name == 'binary':
+        return BinaryCodec()
+    raise ValueError(f"未知的编码: {name}")
+
+
+def decode_data(raw):
+    """按内容识别并解码快照：二进制快照或任意格式的JSON"""
+    if raw.startswith(SNAPSHOT_MAGIC):
+        return pickle.loads(raw[len(SNAPSHOT_MAGIC):])
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # NaN等orjson不接受的写法交给标准库
+    return json.loads(raw.decode('utf-8'))
+
+
+def compact_dumps(value):
+    """编码为一行紧凑JSON字符串，用于日志和数据库字段"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value).decode('utf-8')
+        except TypeError:
+            pass
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+compact_loads = orjson.loads if orjson is not None else json.loads
+
+
+def iter_json(value, batch=1000, depth=2):
+    """把值编码为一段段紧凑JSON字符串，用于流式响应
+
+    只展开最外 depth 层容器，最内层展开的列表或字典每 batch 个元素编码为一段，
+    峰值内存只与一段的大小有关。各段依次拼接即为完整的JSON。
+    """
+    if depth <= 0 or not isinstance(value, (list, dict)) or not value:
+        yield compact_dumps(value)
+        return
+    if depth > 1:
+        if isinstance(value, list):
+            yield '['
+            for i, item in enumerate(value):
+                if i:
+                    yield ','
+                yield from iter_json(item, batch, depth - 1)
+            yield ']'
+        else:
+            yield '{'
+            for i, (key, item) in enumerate(value.items()):
+                yield (',' if i else '') + compact_dumps(str(key)) + ':'
+                yield from iter_json(item, batch, depth - 1)
+            yield '}'
+        return
+
+    items = value if isinstance(value, list) else list(value.items())
+    open_, close = ('[', ']') if isinstance(value, list) else ('{', '}')
+    yield open_
+    for start in range(0, len(items), batch):
+        part = items[start:start + batch]
+        # 去掉每段自身的括号，段与段之间用逗号连接
+        encoded = compact_dumps(part if isinstance(value, list) else dict(part))[1:-1]
+        yield (',' if start else '') + encoded
+    yield close
+
+# 未指定编码时保持原来的缩进JSON
+default_codec = JsonCodec()
+
+
+def load_json_data(filename, default_data=None):
+    """安全加载JSON数据
+
+    文件不存在时返回默认数据；文件损坏时抛出异常，避免把空数据当成真实数据写回。
+    文件格式按内容识别，也能读取二进制快照。
+    """
+    if default_data is None:
+        default_data = {}
+
+    if not os.path.exists(filename):
+        return default_data
+
+    try:
+        with open(filename, 'rb') as f:
+            return decode_data(f.read())
+    except Exception as e:
+        print(f"加载 {filename} 失败: {e}")
+        raise
+
+
+class _CommitBatch:
+    def __init__(self, seq):
+        self.seq = seq
+        self.files = {}
+        self.results = {}
+        self.done = threading.Event()
+
+
+class GroupCommitWriter:
+    """组提交写入器：时间窗口内到达的写入合并成一次提交
+
+    同一文件在一批中只写最后提交的内容。每个文件先写入同目录下的临时文件并
+    fsync，再原子改名替换，最后每个目录fsync一次；崩溃或并发读取只会看到
+    完整的旧文件或新文件。各批次严格按到达顺序提交。
+    """
+
+    def __init__(self, window=0.005):
+        self.window = window
+        self._lock = threading.Lock()
+        self._commit_cond = threading.Condition()
+        self._current = None
+        self._next_seq = 0
+        self._next_commit = 0
+
+    def write(self, files, codec=None):
+        """提交 {文件名: 数据}，等所在批次落盘后返回是否全部写入成功"""
+        codec = codec or default_codec
+        with self._lock:
+            batch = self._current
+            leader = batch is None
+            if leader:
+                batch = self._current = _CommitBatch(self._next_seq)
+                self._next_seq += 1
+            batch.files.update((name, (data, codec)) for name, data in files.items())
+
+        if not leader:
+            batch.done.wait()
+            return all(batch.results.get(name, False) for name in files)
+
+        # 第一个到达的线程负责本批次：等待窗口结束后统一提交
+        if self.window:
+            time.sleep(self.window)
+        with self._lock:
+            self._current = None
+
+        with self._commit_cond:
+            while self._next_commit != batch.seq:
+                self._commit_cond.wait()
+        try:
+            batch.results = self._commit(batch.files)
+        finally:
+            with self._commit_cond:
+                self._next_commit += 1
+                self._commit_cond.notify_all()
+            batch.done.set()
+        return all(batch.results.get(name, False) for name in files)
+
+    @staticmethod
+    def _commit(files):
+        results = {}
+        staged = []
+        for filename, (data, codec) in files.items():
+            directory = os.path.dirname(os.path.abspath(filename))
+            fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(filename) + '.', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(codec.dumps(data))
+                    f.flush()
+                    os.fsync(f.fileno())
+                staged.append((filename, tmp, directory))
+            except Exception as e:
+                print(f"保存 {filename} 失败: {e}")
+                results[filename] = False
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+        directories = set()
+        for filename, tmp, directory in staged:
+            try:
+                os.replace(tmp, filename)
+                directories.add(directory)
+                results[filename] = True
+            except Exception as e:
+                print(f"保存 {filename} 失败: {e}")
+                results[filename] = False
+                os.remove(tmp)
+
+        # 让改名本身落盘
+        for directory in directories:
+            try:
+                dir_fd = os.open(directory, os.O_RDONLY)
+            except OSError:
+                continue  # 部分平台不支持打开目录
+            try:
+                os.fsync(dir_fd)
+            except OSError:
+                pass
+            finally:
+                os.close(dir_fd)
+        return results
+
+
+# 全局组提交写入器
+group_writer = GroupCommitWriter()
+
+
+def save_json_data(filename, data, codec=None):
+    """安全保存JSON数据：原子替换，短时间内的多次保存合并为一次磁盘提交"""
+    return group_writer.write({filename: data}, codec)
+
+
+def save_json_files(files, codec=None):
+    """在同一批次中原子保存多个JSON文件"""
+    return group_writer.write(files, codec)
+
+
+class RWLock:
+    """读写锁：读共享、写独占，同一线程可重入，有写者等待时新读者让行
+
+    持有写锁的线程可以再加读锁；持有读锁的线程不能升级为写锁。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("持有读锁时不能再申请写锁")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+# _apply 的返回值，表示这条修改没有命中任何记录，无需写入日志
+_UNCHANGED = object()
+
+
+def _shallow_copy(value):
+    """复制集合容器本身，记录对象按写时复制共享"""
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def _matches(record, filters):
+    """记录的各字段是否等于给定值（按字符串比较，与 find 一致）"""
+    if not isinstance(record, dict):
+        return False
+    for field, value in filters.items():
+        actual = record.get(field)
+        if actual is None or str(actual) != str(value):
+            return False
+    return True
+
+
+class JsonStore:
+    """常驻内存的JSON文档存储
+
+    文档的顶层键即集合：列表集合（donations、members等）按记录追加，
+    字典集合（wallets、userPresence等）按键存取。记录按写时复制处理，
+    调用方拿到的记录和集合副本不得原地修改，修改一律通过本类的方法完成。
+
+    每次修改先以一行JSON追加到预写日志（<文件名>.wal），多个并发写入共用
+    一次fsync；后台线程按时间间隔或日志条数把内存状态压缩成新的快照文件并
+    清空日志，启动时先加载快照再重放日志完成崩溃恢复。
+
+    指定 shard_dir 时快照按集合分片，每个集合保存为目录下的一个文件并单独
+    跟踪修改，压缩时只重写变化过的集合；首次启动时从原数据文件迁移。
+
+    并发控制分两级：文档级读写锁，单集合操作持共享锁，整体替换和压缩持独占锁；
+    每个集合再各有一把读写锁，读共享、写独占。transaction() 在整个读-改-写
+    过程中持有所声明集合的写锁。
+
+    shared=True 时允许多个工作进程共用同一份数据：写事务全程持有锁文件上的
+    flock；压缩时递增代数文件中的计数。每个进程在读写前比较代数和日志长度，
+    有变化就从自己读到的位置继续重放日志；代数变了则从轮换走的日志（保留一代）
+    接着重放，接不上时重新加载快照。每条日志带各进程一致的修改序号 seq，
+    代数文件中还保存数据的纪元 epoch 和各集合最后一次修改的序号（见 stamp()），
+    变更令牌和ETag据此在各进程间通用。
+
+    codec 决定快照的编码（见 get_codec）；二进制快照保存为 .snap 文件。
+    加载时按内容识别格式，切换编码后下次压缩会把旧格式的文件改写掉。
+
+    indexes 为列表集合声明哈希索引，如 {'users': ['id', 'username']}：
+    字段值（按字符串）映射到记录位置，插入和更新时同步维护，
+    find 和按索引字段的 update 不再扫描整个集合。
+
+    totals 为列表集合声明按字段分组的累计值，如 {'donations': ('user_id', 'amount')}：
+    每组的记录数和金额合计随插入和更新增量维护，totals() 直接返回。
+
+    read_only=True 时只加载快照并重放日志，不迁移、不压缩、不截断日志，也不能修改，
+    用于从数据文件导出或导入到其他存储。
+
+    listeners 中的函数在每次修改后以 (集合, 操作, 键, 值) 调用：操作为 insert/update
+    （列表集合，键是记录的 id）、put/delete（字典集合）、set（整个集合）或 reset（整个文档）；
+    共享模式下其他进程的修改在本进程同步到时通知。
+    """
+
+    def __init__(self, filename, default_data=None, flush_interval=1.0, flush_threshold=100,
+                 journal_fsync=True, shard_dir=None, shared=False, codec=None, indexes=None, totals=None,
+                 read_only=False):
+        self.filename = filename
+        self.read_only = read_only
+        self.shard_dir = shard_dir
+        self.codec = codec or default_codec
+        self.indexes = {collection: tuple(fields) for collection, fields in (indexes or {}).items()}
+        # 集合 -> 字段 -> 字段值 -> 记录位置列表（升序）
+        self._index = {}
+        self.total_fields = dict(totals or {})
+        # 集合 -> 分组值 -> [记录数, 合计]
+        self._totals = {}
+        base, ext = os.path.splitext(filename)
+        if ext not in SNAPSHOT_SUFFIXES:
+            base = filename
+        # 单文件模式下快照的各种编码版本，当前编码的排在最前
+        self._snapshot_files = [filename if self.codec.suffix == ext else base + self.codec.suffix]
+        self._snapshot_files += [path for path in {filename, base + BinaryCodec.suffix}
+                                 if path != self._snapshot_files[0]]
+        self.shared = shared
+        self._default_data = default_data
+        self.journal_file = os.path.join(shard_dir, '_journal.wal') if shard_dir else filename + '.wal'
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.journal_fsync = journal_fsync
+        self._doc_lock = RWLock()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._local = threading.local()
+        self.listeners = []
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._dirty = 0
+        self._dirty_collections = set()
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._journal_offset = 0
+        self._generation = 0
+        # 共享模式：修改序号、数据纪元、各集合最后一次修改的序号（未记录的取 _base_seq）
+        self.seq = 0
+        self.epoch = None
+        self._base_seq = 0
+        self._collection_seqs = {}
+
+        if shared:
+            if fcntl is None:
+                raise RuntimeError("多进程模式需要 fcntl，仅支持类Unix系统")
+            self._process_mutex = threading.Lock()
+            self._generation_file = filename + '.gen'
+            self._lock_fd = open(filename + '.lock', 'a')
+            self._compact_lock_fd = open(filename + '.compact.lock', 'a')
+
+        with self._process_lock() if shared else nullcontext():
+            self._load()
+            self._journal = None if read_only else open(self.journal_file, 'a', encoding='utf-8')
+            if shared:
+                self.epoch = self._read_state().get('epoch')
+                if self.epoch is None and not read_only:
+                    self.epoch = os.urandom(4).hex()
+                    self._save_state()
+
+    @property
+    def _compacting_file(self):
+        return self.journal_file + '.compacting'
+
+    @property
+    def _previous_file(self):
+        return self.journal_file + '.prev'
+
+    def _load(self):
+        """加载快照并重放日志"""
+        self._dirty = 0
+        self._dirty_collections = set()
+        if self.shared:
+            state = self._read_state()
+            self._generation = state.get('generation', 0)
+            self.seq = state.get('seq', 0)
+            self._base_seq = state.get('base', self.seq)
+            self._collection_seqs = dict(state.get('collections', {}))
+        if self.shard_dir and os.path.isdir(self.shard_dir):
+            self._rebuild_indexes(data=self._load_shards())
+        else:
+            path = self._latest(self._snapshot_files)
+            data = load_json_data(path, None) if path else None
+            if data is None:
+                # 文件不存在时使用初始数据，并尽快落盘
+                data = json.loads(json.dumps(self._default_data or {}))
+                self._dirty = 1
+            elif path != self._snapshot_files[0]:
+                self._dirty = 1  # 旧格式的快照，下次压缩时改写
+            self._rebuild_indexes(data=data)
+            if self.shard_dir and self.read_only:
+                # 尚未迁移：日志仍在原数据文件旁
+                self._replay(self.filename + '.wal.compacting')
+                self._replay(self.filename + '.wal')
+            elif self.shard_dir:
+                self._migrate_to_shards()
+
+        # 崩溃恢复：先重放上次未完成压缩的日志，再重放当前日志
+        count, _ = self._replay(self._compacting_file)
+        self._dirty += count
+        count, self._journal_offset = self._replay(self.journal_file)
+        self._dirty += count
+        self._notify(None, 'reset')
+
+    # 多进程
+
+    @contextmanager
+    def _process_lock(self):
+        """跨进程写锁：进程内互斥，再对锁文件加 flock"""
+        with self._process_mutex:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _read_state(self):
+        """读取代数文件：压缩代数、轮换时的修改序号、纪元和各集合的修改序号"""
+        try:
+            with open(self._generation_file, 'r', encoding='utf-8') as f:
+                state = json.loads(f.read() or '0')
+        except (FileNotFoundError, ValueError):
+            state = 0
+        if not isinstance(state, dict):
+            # 旧格式只有代数
+            state = {'generation': state if isinstance(state, int) else 0}
+        return state
+
+    def _save_state(self):
+        save_json_data(self._generation_file, {'generation': self._generation, 'seq': self.seq,
+                                               'epoch': self.epoch, 'base': self._base_seq,
+                                               'collections': self._collection_seqs})
+
+    def _read_generation(self):
+        return self._read_state().get('generation', 0)
+
+    def _changed(self):
+        """其他进程是否写入了日志或完成了压缩"""
+        try:
+            size = os.path.getsize(self.journal_file)
+        except FileNotFoundError:
+            return True
+        return size != self._journal_offset or self._read_generation() != self._generation
+
+    def _catch_up(self):
+        """把其他进程的修改同步到内存，调用方需持有跨进程锁"""
+        if not self._changed():
+            return
+        with self._doc_lock.write(), self._journal_lock:
+            if self._read_generation() != self._generation:
+                # 其他进程完成了压缩：日志已轮换，接不上时重新加载快照
+                if not self._follow_rotation():
+                    self._load()
+                self._journal.close()
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            else:
+                count, self._journal_offset = self._replay(self.journal_file, self._journal_offset, notify=True)
+                self._dirty += count
+
+    def _follow_rotation(self):
+        """其他进程轮换日志后，从轮换走的日志中接着重放本进程尚未读到的修改
+
+        错过了不止一次压缩（或日志没有修改序号）时返回 False，由调用方重新加载快照。
+        """
+        state = self._read_state()
+        for path in (self._previous_file, self._compacting_file):
+            self._replay(path, notify=True, follow=True)
+        if self.seq < state.get('seq', 0):
+            return False
+        # 轮换走的修改已由压缩它的进程写入快照
+        self._dirty = 0
+        self._dirty_collections = set()
+        self._generation = state.get('generation', 0)
+        count, self._journal_offset = self._replay(self.journal_file, notify=True, follow=True)
+        self._dirty += count
+        return True
+
+    def refresh(self):
+        """共享模式下同步其他进程的修改"""
+        self._refresh()
+
+    def stamp(self, collections=()):
+        """给定集合最后一次修改的序号之和，共享模式下各进程一致；不指定集合时为整个文档的修改序号"""
+        if not collections:
+            return self.seq
+        return sum(self._collection_seqs.get(name, self._base_seq) for name in collections)
+
+    def _refresh(self):
+        """共享模式下读取前同步其他进程的修改；事务内已同步过，无需再查"""
+        if self.shared and not getattr(self._local, 'depth', 0) and self._changed():
+            with self._process_lock():
+                self._catch_up()
+
+    # 锁
+
+    def _collection_lock(self, collection):
+        lock = self._locks.get(collection)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(collection, RWLock())
+        return lock
+
+    @contextmanager
+    def _reading(self, collection):
+        self._refresh()
+        with self._doc_lock.read(), self._collection_lock(collection).read():
+            yield
+
+    @contextmanager
+    def transaction(self, *collections):
+        """对给定集合加写锁，在锁内完成读-改-写；不指定集合时独占整个文档
+
+        最外层退出时等待日志落盘。事务内修改的集合都应事先声明，
+        以免各线程加锁顺序不一致导致死锁。
+        """
+        depth = getattr(self._local, 'depth', 0)
+        with ExitStack() as stack:
+            if self.shared and depth == 0:
+                stack.enter_context(self._process_lock())
+                self._catch_up()
+            if collections:
+                stack.enter_context(self._doc_lock.read())
+                for name in sorted(set(collections)):
+                    stack.enter_context(self._collection_lock(name).write())
+            else:
+                stack.enter_context(self._doc_lock.write())
+            self._local.depth = depth + 1
+            try:
+                yield self
+            finally:
+                self._local.depth = depth
+        if depth == 0:
+            self._sync(getattr(self._local, 'seq', 0))
+
+    # 读取
+
+    def all(self, collection, default=None):
+        """获取整个集合的浅副本"""
+        with self._reading(collection):
+            if collection not in self.data:
+                return default
+            return _shallow_copy(self.data[collection])
+
+    def get(self, collection, key, default=None):
+        """按键获取字典集合中的一项"""
+        with self._reading(collection):
+            return self.data.get(collection, {}).get(key, default)
+
+    def find(self, collection, field, value):
+        """查找列表集合中字段等于给定值的全部记录（按字符串比较）"""
+        with self._reading(collection):
+            records = self.data.get(collection, [])
+            index = self._index.get(collection, {}).get(field)
+            if index is not None:
+                return [records[i] for i in index.get(str(value), ())]
+            return [r for r in records if isinstance(r, dict) and r.get(field) is not None
+                    and str(r.get(field)) == str(value)]
+
+    def page(self, collection, field, value, limit, before=None, after=None, filters=None):
+        """按插入顺序从新到旧分页读取字段等于给定值的记录，返回 [(游标, 记录)]
+
+        游标是记录在集合中的位置。before 取比游标更早的一页，after 取比游标更新的一页；
+        字段有索引时耗时只与 limit 成正比。field 为 None 时不按字段定位，读取整个集合；
+        filters 为其他字段的相等条件，在定位出的记录上逐条检查，直到凑满一页。
+        """
+        with self._reading(collection):
+            records = self.data.get(collection, [])
+            positions = self._positions(collection, field, value)
+            limit = max(limit, 0)
+            if after is not None:
+                start = bisect_right(positions, after)
+                candidates = (positions[i] for i in range(start, len(positions)))
+            else:
+                end = bisect_left(positions, before) if before is not None else len(positions)
+                candidates = (positions[i] for i in range(end - 1, -1, -1))
+            if filters:
+                candidates = (i for i in candidates if _matches(records[i], filters))
+            selected = list(itertools.islice(candidates, limit))
+            if after is not None:
+                selected.reverse()
+            return [(i, records[i]) for i in selected]
+
+    def count(self, collection, field=None, value=None):
+        """字段等于给定值的记录数，不指定字段时为集合的记录数"""
+        with self._reading(collection):
+            return len(self._positions(collection, field, value))
+
+    def _positions(self, collection, field, value):
+        """字段等于给定值的记录位置（升序），field 为 None 时为全部位置"""
+        records = self.data.get(collection, [])
+        if field is None:
+            return range(len(records))
+        index = self._index.get(collection, {}).get(field)
+        if index is not None:
+            return index.get(str(value), [])
+        return [i for i, r in enumerate(records) if _matches(r, {field: value})]
+
+    def totals(self, collection, key):
+        """返回分组值对应的记录数和合计"""
+        with self._reading(collection):
+            count, total = self._totals[collection].get(str(key), (0, 0.0))
+            return count, total
+
+    def snapshot(self):
+        """获取整个文档的浅副本"""
+        self._refresh()
+        return self._snapshot()
+
+    def _snapshot(self):
+        with self._doc_lock.write():
+            return {name: _shallow_copy(value) for name, value in self.data.items()}
+
+    # 修改
+
+    def insert(self, collection, record):
+        """向列表集合追加一条记录"""
+        with self.transaction(collection):
+            index = len(self.data.get(collection, []))
+            self._commit({'op': 'insert', 'c': collection, 'i': index, 'v': record})
+        return record
+
+    def update(self, collection, key, changes, field='id'):
+        """按字段匹配（按字符串比较）更新列表集合中的第一条记录，返回更新后的记录"""
+        with self.transaction(collection):
+            return self._commit({'op': 'update', 'c': collection, 'f': field, 'k': key, 'v': changes})
+
+    def put(self, collection, key, value):
+        """写入字典集合中的一项"""
+        with self.transaction(collection):
+            self._commit({'op': 'put', 'c': collection, 'k': key, 'v': value})
+        return value
+
+    def set(self, collection, value, index=None):
+        """整体替换一个集合；给出 index 时只替换列表集合中该位置的记录"""
+        with self.transaction(collection):
+            op = {'op': 'set', 'c': collection, 'v': value}
+            if index is not None:
+                op['i'] = index
+            self._commit(op)
+        return value
+
+    def delete(self, collection, key):
+        """删除字典集合中的一项，返回被删除的值"""
+        with self.transaction(collection):
+            if key not in self.data.get(collection, {}):
+                return None
+            return self._commit({'op': 'delete', 'c': collection, 'k': key})
+
+    def replace(self, data):
+        """整体替换文档"""
+        with self.transaction():
+            self._commit({'op': 'replace', 'v': data})
+
+    def _commit(self, op):
+        """应用一次修改并追加到日志，调用方需持有对应集合的写锁"""
+        if self.read_only:
+            raise RuntimeError(f"{self.filename} 以只读方式打开，不能修改")
+        if op['op'] == 'replace':
+            self._dirty_collections.update(self.data)
+        result = self._apply(op)
+        if result is _UNCHANGED:
+            return None
+        if self.shared:
+            # 持有跨进程锁且已同步，序号在各进程间连续
+            op['s'] = self.seq + 1
+            self._advance(op)
+        self._publish(op, result)
+        line = compact_dumps(op) + '\n'
+        with self._journal_lock:
+            self._journal.write(line)
+            if self.shared:
+                # 释放跨进程锁前让其他进程能读到这一行
+                self._journal.flush()
+                self._journal_offset += len(line.encode('utf-8'))
+            self._written_seq += 1
+            self._local.seq = self._written_seq
+            self._dirty += 1
+            if op['op'] == 'replace':
+                self._dirty_collections.update(self.data)
+            else:
+                self._dirty_collections.add(op['c'])
+            if self._dirty >= self.flush_threshold:
+                self._wakeup.set()
+        return result
+
+    def _apply(self, op):
+        """把一条日志应用到内存文档；重复应用同一段日志结果不变"""
+        kind = op['op']
+        if kind == 'replace':
+            self._rebuild_indexes(data=op['v'])
+            return None
+
+        collection = op['c']
+        indexes = self._index.get(collection)
+        if kind == 'insert':
+            records = self.data.setdefault(collection, [])
+            # 记录位置已存在说明快照中已包含这条日志
+            if len(records) <= op['i']:
+                records.append(op['v'])
+                if indexes:
+                    self._index_add(indexes, len(records) - 1, op['v'])
+                if collection in self._totals:
+                    self._totals_add(collection, op['v'], 1)
+            return op['v']
+
+        if kind == 'update':
+            records = self.data.get(collection, [])
+            field, key = op['f'], op['k']
+            if indexes and field in indexes:
+                candidates = indexes[field].get(str(key), ()) if key is not None else ()
+            else:
+                candidates = range(len(records))
+            for i in candidates:
+                record = records[i]
+                if _matches(record, {field: key}):
+                    updated = dict(record)
+                    updated.update(op['v'])
+                    records[i] = updated
+                    if indexes:
+                        self._index_move(indexes, i, record, updated)
+                    if collection in self._totals:
+                        self._totals_add(collection, record, -1)
+                        self._totals_add(collection, updated, 1)
+                    return updated
+            return _UNCHANGED
+
+        if kind == 'put':
+            self.data.setdefault(collection, {})[op['k']] = op['v']
+            return op['v']
+
+        if kind == 'set':
+            if 'i' not in op:
+                self._rebuild_indexes([collection], {collection: op['v']})
+                return op['v']
+            records = self.data[collection]
+            old = records[op['i']]
+            records[op['i']] = op['v']
+            if indexes:
+                self._index_move(indexes, op['i'], old, op['v'])
+            if collection in self._totals:
+                self._totals_add(collection, old, -1)
+                self._totals_add(collection, op['v'], 1)
+            return op['v']
+
+        if kind == 'delete':
+            return self.data.get(collection, {}).pop(op['k'], None)
+
+        raise ValueError(f"未知的日志操作: {kind}")
+
+    def _advance(self, op):
+        """记下一条日志的修改序号"""
+        self.seq = op['s']
+        if op['op'] == 'replace':
+            self._base_seq = op['s']
+            self._collection_seqs = {}
+        else:
+            self._collection_seqs[op['c']] = op['s']
+
+    # 通知
+
+    def _notify(self, collection, kind, key=None, value=None):
+        for listener in self.listeners:
+            listener(collection, kind, key, value)
+
+    def _publish(self, op, result):
+        """把一条已应用的日志转换成变更通知"""
+        if not self.listeners:
+            return
+        kind = op['op']
+        if kind == 'replace':
+            self._notify(None, 'reset')
+        elif kind == 'delete':
+            self._notify(op['c'], 'delete', op['k'])
+        elif kind == 'put':
+            self._notify(op['c'], 'put', op['k'], op['v'])
+        elif kind == 'set' and 'i' not in op:
+            self._notify(op['c'], 'set', None, op['v'])
+        elif kind == 'set':
+            self._notify(op['c'], 'update', result.get('id'), result)
+        else:
+            self._notify(op['c'], kind, result.get('id'), result)
+
+    # 索引
+
+    def _rebuild_indexes(self, collections=None, data=None):
+        """按新文档（默认为当前文档）重建索引和累计值，不指定集合时全部重建
+
+        索引和累计值全部建好后才与文档一起替换，中途出错时内存中的状态保持不变。
+        """
+        data = self.data if data is None else data
+        index = {} if collections is None else dict(self._index)
+        totals = {} if collections is None else dict(self._totals)
+        for collection, fields in self.indexes.items():
+            if collections is not None and collection not in collections:
+                continue
+            indexes = index[collection] = {field: {} for field in fields}
+            records = data.get(collection)
+            if isinstance(records, list):
+                for i, record in enumerate(records):
+                    self._index_add(indexes, i, record)
+
+        for collection in self.total_fields:
+            if collections is not None and collection not in collections:
+                continue
+            totals[collection] = {}
+            records = data.get(collection)
+            if isinstance(records, list):
+                for record in records:
+                    self._totals_add(collection, record, 1, totals)
+
+        if collections is None:
+            self.data = data
+        else:
+            for collection in collections:
+                self.data[collection] = data[collection]
+        self._index, self._totals = index, totals
+
+    @staticmethod
+    def _index_add(indexes, position, record):
+        # 非对象记录不进索引
+        if not isinstance(record, dict):
+            return
+        for field, index in indexes.items():
+            value = record.get(field)
+            if value is not None:
+                index.setdefault(str(value), []).append(position)
+
+    @staticmethod
+    def _index_move(indexes, position, old, new):
+        """记录更新后把位置从旧值移到新值下"""
+        for field, index in indexes.items():
+            before = old.get(field) if isinstance(old, dict) else None
+            after = new.get(field) if isinstance(new, dict) else None
+            if before == after:
+                continue
+            if before is not None:
+                positions = index[str(before)]
+                positions.remove(position)
+                if not positions:
+                    del index[str(before)]
+            if after is not None:
+                insort(index.setdefault(str(after), []), position)
+
+    def _totals_add(self, collection, record, sign, totals=None):
+        if not isinstance(record, dict):
+            return
+        totals = self._totals if totals is None else totals
+        group_field, value_field = self.total_fields[collection]
+        key = record.get(group_field)
+        if key is None:
+            return
+        try:
+            amount = float(record.get(value_field, 0))
+        except (TypeError, ValueError):
+            amount = 0.0
+        group = totals[collection].setdefault(str(key), [0, 0.0])
+        group[0] += sign
+        group[1] += sign * amount
+        if not group[0]:
+            del totals[collection][str(key)]
+
+    # 日志
+
+    def _replay(self, path, offset=0, notify=False, follow=False):
+        """从给定位置重放日志文件，返回应用的条数和读到的位置
+
+        follow=True 时按修改序号只应用本进程尚未读到的日志，序号接不上时停止。
+        """
+        if not os.path.exists(path):
+            return 0, 0
+        count = 0
+        with open(path, 'rb' if self.read_only else 'rb+') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete line')
+                    op = compact_loads(line)
+                except ValueError:
+                    # 崩溃时写了一半的末行，截掉以免后续追加的记录接在它后面
+                    print(f"忽略 {path} 中不完整的日志记录")
+                    if not self.read_only:
+                        f.truncate(offset)
+                    break
+                seq = op.get('s')
+                if follow and (seq is None or seq > self.seq + 1):
+                    break
+                if follow and seq <= self.seq:
+                    offset += len(line)
+                    continue
+                if op['op'] == 'replace':
+                    self._dirty_collections.update(self.data)
+                result = self._apply(op)
+                if seq is not None and seq > self.seq:
+                    self._advance(op)
+                if notify and result is not _UNCHANGED:
+                    self._publish(op, result)
+                self._dirty_collections.update(self.data if op['op'] == 'replace' else (op['c'],))
+                offset += len(line)
+                count += 1
+        return count, offset
+
+    def _sync(self, seq):
+        """组提交：一次fsync让所有已写入的日志落盘"""
+        if seq <= self._synced_seq:
+            return
+        with self._sync_lock:
+            if seq <= self._synced_seq:
+                return
+            with self._journal_lock:
+                self._journal.flush()
+                target = self._written_seq
+                fd = self._journal.fileno()
+            if self.journal_fsync:
+                os.fsync(fd)
+            self._synced_seq = target
+
+    def _rotate_journal(self):
+        """把当前日志移入待压缩文件并开启新日志，调用方需持有同步锁和文档独占锁"""
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._synced_seq = self._written_seq
+        self._journal.close()
+        if os.path.exists(self._compacting_file):
+            # 上次压缩失败，把当前日志接在后面
+            with open(self.journal_file, 'r', encoding='utf-8') as src, \
+                    open(self._compacting_file, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.journal_file)
+        else:
+            os.replace(self.journal_file, self._compacting_file)
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._journal_offset = 0
+        if self.shared:
+            # 通知其他进程日志已轮换
+            self._generation = self._read_generation() + 1
+            self._save_state()
+
+    # 分片
+
+    @staticmethod
+    def _latest(paths):
+        """同一快照存在多种编码的文件时取最后写入的一个"""
+        existing = [path for path in paths if os.path.exists(path)]
+        return max(existing, key=os.path.getmtime) if existing else None
+
+    def _shard_path(self, collection, shard_dir=None, suffix=None):
+        return os.path.join(shard_dir or self.shard_dir, quote(collection, safe='') + (suffix or self.codec.suffix))
+
+    def _load_shards(self):
+        collections = set()
+        for name in os.listdir(self.shard_dir):
+            stem, suffix = os.path.splitext(name)
+            if suffix in SNAPSHOT_SUFFIXES:
+                collections.add(unquote(stem))
+
+        data = {}
+        for collection in sorted(collections):
+            variants = [self._shard_path(collection, suffix=suffix) for suffix in SNAPSHOT_SUFFIXES]
+            path = self._latest(variants)
+            data[collection] = load_json_data(path)
+            if path != self._shard_path(collection) or sum(map(os.path.exists, variants)) > 1:
+                # 旧格式的分片，下次压缩时改写
+                self._dirty += 1
+                self._dirty_collections.add(collection)
+        return data
+
+    def _migrate_to_shards(self):
+        """把整个文档写成分片目录；先写临时目录再改名，迁移中途崩溃不会留下半个目录"""
+        legacy_journals = (self.filename + '.wal.compacting', self.filename + '.wal')
+        for path in legacy_journals:
+            self._replay(path)
+
+        tmp_dir = self.shard_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        shards = {self._shard_path(collection, tmp_dir): value for collection, value in self.data.items()}
+        if not save_json_files(shards, self.codec):
+            raise OSError(f"迁移 {self.filename} 到 {self.shard_dir} 失败")
+        os.replace(tmp_dir, self.shard_dir)
+
+        for path in legacy_journals:
+            if os.path.exists(path):
+                os.remove(path)
+        self._dirty = 0
+        self._dirty_collections = set()
+        print(f"已将 {self.filename} 迁移为按集合分片存储: {self.shard_dir}")
+
+    def _write_snapshot(self, doc, collections):
+        """写入快照；分片模式下只重写给定的集合"""
+        if not self.shard_dir:
+            if not save_json_data(self._snapshot_files[0], doc, self.codec):
+                return False
+            stale = self._snapshot_files[1:]
+        else:
+            shards = {self._shard_path(name): doc[name] for name in collections if name in doc}
+            if not save_json_files(shards, self.codec):
+                return False
+            stale = [self._shard_path(collection, suffix=suffix)
+                     for collection in collections for suffix in SNAPSHOT_SUFFIXES
+                     if collection not in doc or suffix != self.codec.suffix]
+        for path in stale:
+            if os.path.exists(path):
+                os.remove(path)
+        return True
+
+    def export(self, filename, codec=None):
+        """把当前数据导出为可读JSON文件"""
+        return save_json_data(filename, self.snapshot(), codec or JsonCodec())
+
+    # 压缩
+
+    def flush(self):
+        """把日志压缩进新的快照文件"""
+        if self.read_only:
+            return True
+        with self._flush_lock, ExitStack() as stack:
+            if self.shared:
+                # 同一时刻只允许一个进程压缩，其余进程直接跳过
+                try:
+                    fcntl.flock(self._compact_lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return True
+                stack.callback(fcntl.flock, self._compact_lock_fd, fcntl.LOCK_UN)
+
+            with self._sync_lock, self._process_lock() if self.shared else nullcontext():
+                if self.shared:
+                    self._catch_up()
+                with self._doc_lock.write(), self._journal_lock:
+                    if not self._dirty:
+                        return True
+                    dirty = self._dirty
+                    collections = self._dirty_collections
+                    self._dirty = 0
+                    self._dirty_collections = set()
+                    if self.shard_dir:
+                        doc = {name: _shallow_copy(self.data[name]) for name in collections if name in self.data}
+                    else:
+                        doc = self._snapshot()
+                    self._rotate_journal()
+
+            if self._write_snapshot(doc, collections):
+                # 共享模式下其他进程可能正在按旧快照加日志重新加载，删除日志需持锁；
+                # 保留一代，让只落后一次压缩的进程接着重放而不必重新加载
+                with self._process_lock() if self.shared else nullcontext():
+                    if self.shared:
+                        os.replace(self._compacting_file, self._previous_file)
+                    else:
+                        os.remove(self._compacting_file)
+                return True
+
+            with self._journal_lock:
+                self._dirty += dirty
+                self._dirty_collections.update(collections)
+            return False
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        """启动后台压缩线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+        return self
+
+    def close(self):
+        """停止后台线程，压缩剩余日志"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        if self.read_only:
+            return
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+        with self._sync_lock, self._journal_lock:
+            self._journal.close()
+        if self.shared:
+            self._lock_fd.close()
+            self._compact_lock_fd.close()
+
+
+# SQLite 表结构：集合名 -> (表名, 类型)；list 按插入顺序保存记录，dict 按键保存
+SQLITE_TABLES = {
+    'users': ('users', 'list'),
+    'members': ('members', 'list'),
+    'donations': ('donations', 'list'),
+    'applications': ('applications', 'list'),
+    'wallet_transactions': ('wallet_transactions', 'list'),
+    'wallets': ('wallets', 'dict'),
+    'userPresence': ('user_presence', 'dict'),
+    'adminSessions': ('admin_sessions', 'dict'),
+}
+
+
+class SqliteStore:
+    """SQLite存储引擎，与 JsonStore 提供相同的接口
+
+    每个已知集合对应一张WAL模式下的表，记录以JSON文本保存在doc列，
+    id、username、user_id、created_at 另存为带索引的列，find 按这些字段查询时
+    直接走索引。indexes 中声明的其他字段在 doc 上建表达式索引。
+    不属于本实例的顶层键整体保存在 extras 表中。
+
+    写操作共用一个连接并由锁串行化；读操作从只读连接池取连接，
+    借助WAL模式与写事务并行执行。池中最多保留 readers 个空闲连接，多出的用完即关闭，
+    每个请求一个线程时连接数也不会随线程数增长。
+
+    listeners 的调用方式与 JsonStore 相同，在写事务提交后通知；其他进程的修改
+    只能在 refresh() 时发现，以整体 reset 通知。
+
+    versions 表记录每张表的提交次数，每次提交只增加修改过的表；seq 为本实例各表之和，
+    与数据库中保存的纪元 epoch 一起供变更令牌和ETag在各进程间通用。
+    """
+
+    INDEXED_FIELDS = ('id', 'username', 'user_id', 'created_at')
+
+    def __init__(self, db_file, collections, default_data=None, import_file=None, extras=False,
+                 journal_fsync=True, totals=None, indexes=None, import_shard_dir=None, readers=8):
+        self.db_file = db_file
+        self.collections = {name: SQLITE_TABLES[name] for name in collections}
+        self.total_fields = dict(totals or {})
+        # 需要在 doc 上建表达式索引的字段
+        self.json_indexes = {}
+        for collection, fields in (indexes or {}).items():
+            if collection not in self.collections:
+                continue
+            for field in fields:
+                if not re.fullmatch(r'[A-Za-z_]\w*', field):
+                    raise ValueError(f"不支持的索引字段: {field}")
+            self.json_indexes[collection] = {f for f in fields if f not in self.INDEXED_FIELDS}
+        self.extras = extras
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self.listeners = []
+        # 空闲的只读连接
+        self._readers = []
+        self._readers_guard = threading.Lock()
+        self.max_readers = readers
+        self._closed = False
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(f"PRAGMA synchronous={'FULL' if journal_fsync else 'NORMAL'}")
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self._data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        # 本实例的表；versions 表按表记录提交次数，refresh 据此忽略同一数据库中其他实例的提交
+        self._tables = sorted({table for table, _ in self.collections.values()} | ({'extras'} if extras else set()))
+        self._versions = {}
+
+        with self.transaction():
+            if self._create_tables():
+                # 新建的数据库：从原有JSON文件一次性导入
+                if import_file and (os.path.exists(import_file)
+                                    or import_shard_dir and os.path.isdir(import_shard_dir)):
+                    self.import_json(import_file, import_shard_dir)
+                elif default_data:
+                    self.replace(json.loads(json.dumps(default_data)))
+        with self.lock:
+            self._versions = self._read_versions()
+            self.epoch = format(self.conn.execute("SELECT version FROM versions WHERE name = 'epoch'")
+                                .fetchone()[0], '08x')
+
+    def _create_tables(self):
+        """建表建索引，返回本实例的表此前是否都不存在"""
+        existing = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        fresh = not any(table in existing for table, _ in self.collections.values())
+
+        columns = ', '.join(f'{field} TEXT' for field in self.INDEXED_FIELDS)
+        for table, kind in self.collections.values():
+            if kind == 'list':
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                                  f'seq INTEGER PRIMARY KEY AUTOINCREMENT, {columns}, doc TEXT NOT NULL)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_id ON {table}(id)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_username ON {table}(username)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_user_id ON {table}(user_id, created_at)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_user_seq ON {table}(user_id, seq)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_created_at ON {table}(created_at)')
+            else:
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                                  f'key TEXT PRIMARY KEY, {columns}, doc TEXT NOT NULL)')
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_username ON {table}(username)')
+        for collection, fields in self.json_indexes.items():
+            table, _ = self.collections[collection]
+            for field in sorted(fields):
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_doc_{field} ON {table}({self._json_text(field)})')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS extras (name TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+        self.conn.executemany('INSERT OR IGNORE INTO versions VALUES (?, 0)', [(table,) for table in self._tables])
+        self.conn.execute("INSERT OR IGNORE INTO versions VALUES ('epoch', ?)",
+                          (int.from_bytes(os.urandom(4), 'big'),))
+        return fresh
+
+    def _read_versions(self):
+        placeholders = ', '.join('?' * len(self._tables))
+        return dict(self.conn.execute(f'SELECT name, version FROM versions WHERE name IN ({placeholders})',
+                                      self._tables).fetchall())
+
+    def _tables_of(self, collections):
+        """修改过的集合对应的表；不确定时返回全部表"""
+        if not collections or None in collections:
+            return self._tables
+        tables = {self.collections[name][0] if name in self.collections else 'extras' for name in collections}
+        return sorted(tables & set(self._tables)) or self._tables
+
+    @property
+    def seq(self):
+        """本实例各表的提交次数之和，各进程一致"""
+        return sum(self._versions.values())
+
+    def stamp(self, collections=()):
+        """给定集合所在表的提交次数之和；不指定集合时为 seq"""
+        if not collections:
+            return self.seq
+        return sum(self._versions.get(table, 0) for table in self._tables_of(collections))
+
+    def import_json(self, filename, shard_dir=None):
+        """从JSON数据文件（含未压缩的日志）导入全部集合；按集合分片存储时传入分片目录
+
+        源文件以只读方式加载，不会被迁移或压缩。
+        """
+        source = JsonStore(filename, shard_dir=shard_dir, read_only=True)
+        try:
+            self.replace(source.snapshot())
+        finally:
+            source.close()
+
+    @staticmethod
+    def _dumps(value):
+        return compact_dumps(value)
+
+    def _columns(self, record):
+        values = []
+        for field in self.INDEXED_FIELDS:
+            value = record.get(field) if isinstance(record, dict) else None
+            values.append(None if value is None else str(value))
+        return values
+
+    def _insert_row(self, table, kind, record, key=None):
+        columns = ', '.join(self.INDEXED_FIELDS)
+        if kind == 'list':
+            self.conn.execute(f'INSERT INTO {table} ({columns}, doc) VALUES (?, ?, ?, ?, ?)',
+                              (*self._columns(record), self._dumps(record)))
+        else:
+            self.conn.execute(f'INSERT OR REPLACE INTO {table} (key, {columns}, doc) VALUES (?, ?, ?, ?, ?, ?)',
+                              (key, *self._columns(record), self._dumps(record)))
+
+    def _get_extra(self, name, conn=None):
+        row = (conn or self.conn).execute('SELECT doc FROM extras WHERE name = ?', (name,)).fetchone()
+        return compact_loads(row[0]) if row else None
+
+    def _set_extra(self, name, value):
+        self.conn.execute('INSERT OR REPLACE INTO extras (name, doc) VALUES (?, ?)', (name, self._dumps(value)))
+
+    # 读取
+
+    @contextmanager
+    def _reading(self):
+        """读操作在事务内复用写连接，否则从连接池取一个只读连接开读事务，用完放回"""
+        if getattr(self._local, 'depth', 0):
+            yield self.conn
+            return
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # 嵌套的读操作沿用外层的读事务
+            yield conn
+            return
+        with self._readers_guard:
+            conn = self._readers.pop() if self._readers else None
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA busy_timeout=5000')
+        self._local.conn = conn
+        try:
+            conn.execute('BEGIN')
+            try:
+                yield conn
+            finally:
+                conn.execute('COMMIT')
+        finally:
+            self._local.conn = None
+            with self._readers_guard:
+                if not self._closed and len(self._readers) < self.max_readers:
+                    self._readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def _all(self, conn, collection, default=None):
+        if collection in self.collections:
+            table, kind = self.collections[collection]
+            if kind == 'list':
+                return [compact_loads(doc) for doc, in conn.execute(f'SELECT doc FROM {table} ORDER BY seq')]
+            return {key: compact_loads(doc) for key, doc in conn.execute(f'SELECT key, doc FROM {table}')}
+        if self.extras:
+            value = self._get_extra(collection, conn)
+            if value is not None:
+                return value
+        return default
+
+    def all(self, collection, default=None):
+        """获取整个集合"""
+        with self._reading() as conn:
+            return self._all(conn, collection, default)
+
+    def get(self, collection, key, default=None):
+        """按键获取字典集合中的一项"""
+        with self._reading() as conn:
+            if collection in self.collections:
+                table, _ = self.collections[collection]
+                row = conn.execute(f'SELECT doc FROM {table} WHERE key = ?', (key,)).fetchone()
+                return compact_loads(row[0]) if row else default
+            return (self._all(conn, collection) or {}).get(key, default)
+
+    @staticmethod
+    def _json_text(field):
+        return f"CAST(json_extract(doc, '$.{field}') AS TEXT)"
+
+    def _match(self, collection, field, value):
+        """字段等于给定值（按字符串比较）的查询条件，尽量用上索引"""
+        if field in self.INDEXED_FIELDS:
+            return f'{field} = ?', [str(value)]
+        if field in self.json_indexes.get(collection, ()):
+            # 表达式必须与建索引时一字不差才能走索引
+            return f'{self._json_text(field)} = ?', [str(value)]
+        return 'CAST(json_extract(doc, ?) AS TEXT) = ?', ['$.' + field, str(value)]
+
+    def find(self, collection, field, value):
+        """查找列表集合中字段等于给定值的全部记录（按字符串比较）"""
+        with self._reading() as conn:
+            if collection not in self.collections:
+                records = self._all(conn, collection) or []
+                return [r for r in records if isinstance(r, dict) and r.get(field) is not None
+                    and str(r.get(field)) == str(value)]
+            table, _ = self.collections[collection]
+            where, params = self._match(collection, field, value)
+            rows = conn.execute(f'SELECT doc FROM {table} WHERE {where} ORDER BY seq', params)
+            return [compact_loads(doc) for doc, in rows]
+
+    def _where(self, collection, field, value, filters=None):
+        """字段相等条件组合成的查询条件，field 为 None 且没有 filters 时匹配全部记录"""
+        conditions = {field: value} if field is not None else {}
+        conditions.update(filters or {})
+        clauses, params = [], []
+        for name, expected in conditions.items():
+            clause, values = self._match(collection, name, expected)
+            clauses.append(clause)
+            params.extend(values)
+        return ' AND '.join(clauses) or '1', params
+
+    def page(self, collection, field, value, limit, before=None, after=None, filters=None):
+        """按插入顺序从新到旧分页读取字段等于给定值的记录，返回 [(游标, 记录)]；游标为 seq
+
+        field 为 None 时读取整个集合，filters 为其他字段的相等条件。
+        """
+        table, _ = self.collections[collection]
+        where, params = self._where(collection, field, value, filters)
+        if after is not None:
+            where, order = where + ' AND seq > ?', 'ASC'
+            params.append(after)
+        else:
+            order = 'DESC'
+            if before is not None:
+                where += ' AND seq < ?'
+                params.append(before)
+        with self._reading() as conn:
+            rows = conn.execute(f'SELECT seq, doc FROM {table} WHERE {where} ORDER BY seq {order} LIMIT ?',
+                                (*params, max(limit, 0))).fetchall()
+        if after is not None:
+            rows.reverse()
+        return [(seq, compact_loads(doc)) for seq, doc in rows]
+
+    def count(self, collection, field=None, value=None):
+        """字段等于给定值的记录数，不指定字段时为集合的记录数"""
+        table, _ = self.collections[collection]
+        where, params = self._where(collection, field, value)
+        with self._reading() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {where}', params).fetchone()[0]
+
+    def totals(self, collection, key):
+        """返回分组值对应的记录数和合计，分组字段带索引时只读该组的行"""
+        group_field, value_field = self.total_fields[collection]
+        table, _ = self.collections[collection]
+        where, params = self._match(collection, group_field, key)
+        with self._reading() as conn:
+            count, total = conn.execute(f'SELECT COUNT(*), TOTAL(CAST(json_extract(doc, ?) AS REAL)) '
+                                        f'FROM {table} WHERE {where}', ('$.' + value_field, *params)).fetchone()
+            return count, total
+
+    def snapshot(self):
+        """在同一个读事务内获取整个文档"""
+        with self._reading() as conn:
+            doc = {name: self._all(conn, name) for name in self.collections}
+            if self.extras:
+                for name, value in conn.execute('SELECT name, doc FROM extras'):
+                    doc[name] = compact_loads(value)
+            return doc
+
+    @contextmanager
+    def transaction(self, *collections):
+        """在同一个SQLite写事务内完成读-改-写，异常时回滚
+
+        SQLite的写事务本身锁住整个数据库，collections 仅为与 JsonStore 保持接口一致。
+        """
+        with self.lock:
+            depth = getattr(self._local, 'depth', 0)
+            self._local.depth = depth + 1
+            if depth == 0:
+                self.conn.execute('BEGIN IMMEDIATE')
+                self._local.changes = []
+                self._local.touched = set()
+                total_changes = self.conn.total_changes
+            try:
+                yield self
+            except BaseException:
+                if depth == 0:
+                    self.conn.execute('ROLLBACK')
+                    self._local.changes = []
+                raise
+            else:
+                if depth == 0:
+                    if self.conn.total_changes != total_changes:
+                        tables = self._tables_of(self._local.touched)
+                        placeholders = ', '.join('?' * len(tables))
+                        self.conn.execute(f'UPDATE versions SET version = version + 1 WHERE name IN ({placeholders})',
+                                          tables)
+                        self._versions = self._read_versions()
+                    self.conn.execute('COMMIT')
+                    changes, self._local.changes = self._local.changes, []
+                    for change in changes:
+                        self._notify(*change)
+            finally:
+                self._local.depth = depth
+
+    # 通知
+
+    def _notify(self, collection, kind, key=None, value=None):
+        for listener in self.listeners:
+            listener(collection, kind, key, value)
+
+    def _changed(self, collection, kind, key=None, value=None):
+        """记下一次修改，事务提交后再通知"""
+        self._local.touched.add(collection)
+        if self.listeners:
+            self._local.changes.append((collection, kind, key, value))
+
+    def refresh(self):
+        """发现其他进程提交的修改
+
+        本连接自己的提交不会改变 data_version；同一数据库中其他实例（包括本进程中
+        的另一个存储）的提交会改变它，再比较本实例各表的提交次数，只有自己的表被修改时才通知。
+        """
+        with self.lock:
+            version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            if version == self._data_version:
+                return
+            self._data_version = version
+            versions = self._read_versions()
+            changed, self._versions = versions != self._versions, versions
+            if changed:
+                # 在锁内通知，与本进程提交的通知保持序号顺序
+                self._notify(None, 'reset')
+
+    # 修改
+
+    def insert(self, collection, record):
+        """向列表集合追加一条记录"""
+        with self.transaction():
+            if collection in self.collections:
+                table, kind = self.collections[collection]
+                self._insert_row(table, kind, record)
+            else:
+                records = self._get_extra(collection) or []
+                records.append(record)
+                self._set_extra(collection, records)
+            self._changed(collection, 'insert', record.get('id'), record)
+        return record
+
+    def update(self, collection, key, changes, field='id'):
+        """按字段匹配（按字符串比较）更新列表集合中的第一条记录，返回更新后的记录"""
+        with self.transaction():
+            if collection not in self.collections:
+                records = self._get_extra(collection) or []
+                for i, record in enumerate(records):
+                    if _matches(record, {field: key}):
+                        records[i] = {**record, **changes}
+                        self._set_extra(collection, records)
+                        self._changed(collection, 'update', records[i].get('id'), records[i])
+                        return records[i]
+                return None
+
+            table, _ = self.collections[collection]
+            where, params = self._match(collection, field, key)
+            row = self.conn.execute(f'SELECT seq, doc FROM {table} WHERE {where} ORDER BY seq LIMIT 1',
+                                    params).fetchone()
+            if row is None:
+                return None
+            updated = {**compact_loads(row[1]), **changes}
+            columns = ', '.join(f'{f} = ?' for f in self.INDEXED_FIELDS)
+            self.conn.execute(f'UPDATE {table} SET {columns}, doc = ? WHERE seq = ?',
+                              (*self._columns(updated), self._dumps(updated), row[0]))
+            self._changed(collection, 'update', updated.get('id'), updated)
+            return updated
+
+    def put(self, collection, key, value):
+        """写入字典集合中的一项"""
+        with self.transaction():
+            if collection in self.collections:
+                table, kind = self.collections[collection]
+                self._insert_row(table, kind, value, key)
+            else:
+                items = self._get_extra(collection) or {}
+                items[key] = value
+                self._set_extra(collection, items)
+            self._changed(collection, 'put', key, value)
+        return value
+
+    def set(self, collection, value, index=None):
+        """整体替换一个集合；给出 index 时只替换列表集合中该位置的记录"""
+        with self.transaction():
+            if collection not in self.collections:
+                if index is None:
+                    self._set_extra(collection, value)
+                    self._changed(collection, 'set', None, value)
+                else:
+                    records = self._get_extra(collection)
+                    records[index] = value
+                    self._set_extra(collection, records)
+                    self._changed(collection, 'update', value.get('id'), value)
+                return value
+
+            table, kind = self.collections[collection]
+            if index is None:
+                self.conn.execute(f'DELETE FROM {table}')
+                if kind == 'list':
+                    for record in value or []:
+                        self._insert_row(table, kind, record)
+                else:
+                    for key, item in (value or {}).items():
+                        self._insert_row(table, kind, item, key)
+                self._changed(collection, 'set', None, value)
+                return value
+
+            row = self.conn.execute(f'SELECT seq FROM {table} ORDER BY seq LIMIT 1 OFFSET ?', (index,)).fetchone()
+            if row is None:
+                raise IndexError(f"{collection} 中没有位置 {index} 的记录")
+            columns = ', '.join(f'{f} = ?' for f in self.INDEXED_FIELDS)
+            self.conn.execute(f'UPDATE {table} SET {columns}, doc = ? WHERE seq = ?',
+                              (*self._columns(value), self._dumps(value), row[0]))
+            self._changed(collection, 'update', value.get('id'), value)
+            return value
+
+    def delete(self, collection, key):
+        """删除字典集合中的一项，返回被删除的值"""
+        with self.transaction():
+            if collection not in self.collections:
+                items = self._get_extra(collection) or {}
+                value = items.pop(key, None)
+                if value is not None:
+                    self._set_extra(collection, items)
+                    self._changed(collection, 'delete', key)
+                return value
+            value = self.get(collection, key)
+            if value is not None:
+                table, _ = self.collections[collection]
+                self.conn.execute(f'DELETE FROM {table} WHERE key = ?', (key,))
+                self._changed(collection, 'delete', key)
+            return value
+
+    def replace(self, data):
+        """整体替换文档"""
+        with self.transaction():
+            for name, (table, kind) in self.collections.items():
+                self.conn.execute(f'DELETE FROM {table}')
+                value = data.get(name)
+                if kind == 'list':
+                    for record in value or []:
+                        self._insert_row(table, kind, record)
+                else:
+                    for key, item in (value or {}).items():
+                        self._insert_row(table, kind, item, key)
+            if self.extras:
+                self.conn.execute('DELETE FROM extras')
+                for name, value in data.items():
+                    if name not in self.collections:
+                        self._set_extra(name, value)
+            self._changed(None, 'reset')
+
+    # 维护
+
+    def flush(self):
+        """执行一次WAL检查点"""
+        with self.lock:
+            self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        return True
+
+    def start(self):
+        return self
+
+    def close(self):
+        with self._readers_guard:
+            self._closed = True
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='数据存储工具')
+    parser.add_argument('command', choices=['import-sqlite', 'export'],
+                        help='import-sqlite: 把JSON数据文件导入SQLite数据库；export: 把快照和日志导出为可读JSON')
+    parser.add_argument('--db', default='data.db', help='SQLite数据库文件')
+    parser.add_argument('--data', default='data.json', help='数据文件')
+    parser.add_argument('--users', default='users.json', help='用户文件')
+    parser.add_argument('--shard-dir', default='data.d', help='数据文件的分片目录，为空表示单文件存储')
+    parser.add_argument('--out', default='export', help='导出目录')
+    parser.add_argument('--shared', action='store_true', help='服务器以多进程模式运行时指定')
+    parser.add_argument('--codec', default=os.environ.get('STORE_CODEC', 'fast'), help='服务器使用的快照编码')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        os.makedirs(args.out, exist_ok=True)
+        for filename, shard_dir in ((args.data, args.shard_dir or None), (args.users, None)):
+            store = JsonStore(filename, flush_interval=3600, flush_threshold=10 ** 9, shard_dir=shard_dir,
+                              shared=args.shared, codec=get_codec(args.codec))
+            out = os.path.join(args.out, os.path.basename(filename))
+            store.export(out)
+            print(f"已导出 {filename} -> {out}")
+            store.close()
+
+    if args.command == 'import-sqlite':
+        data_collections = [name for name in SQLITE_TABLES if name != 'users']
+        for filename, shard_dir, collections, extras in ((args.data, args.shard_dir or None, data_collections, True),
+                                                         (args.users, None, ['users'], False)):
+            store = SqliteStore(args.db, collections, extras=extras)
+            store.import_json(filename, shard_dir)
+            print(f"已导入 {filename} -> {args.db}")
+            store.close()